@@ -1,6 +1,13 @@
 # %% imports
 import pandas as pd
 import math
+import os
+import gzip
+import hashlib
+import json
+import time
+import pickle
+import multiprocessing
 import statistics
 import random
 import numpy as np
@@ -10,6 +17,7 @@ from numpy.linalg import LinAlgError
 from queue import Queue
 from abc import ABC, abstractmethod
 from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 
 # %% Define custom exception
@@ -106,15 +114,28 @@ class TheoreticCalculations:
 
 # %% define simulation class
 class Simulation(ABC):
-    def __init__(self, n_stations, duration, rover_station=0, seed=69):
+    def __init__(self, n_stations, duration, rover_station=0, seed=69, service_limits=None,
+                 checkpoint_file=None, checkpoint_interval=100000, trace=None, profiler=None, warmup=None):
         random.seed(seed)
         np.random.seed(seed)
         self.n_stations = n_stations
         self.duration = duration
         self.initial_station = rover_station
+        self.seed = seed
+        # defaults to the limited service constants of the input file
+        self.service_limits = parameters.limited_service_constants if service_limits is None else service_limits
+        # results are only registered after the warmup, which defaults to StationResults.STEADY_STATE_BOUNDARY
+        self.warmup = StationResults.STEADY_STATE_BOUNDARY if warmup is None else warmup
+        # the simulation state is saved every checkpoint_interval time units (if a file is given)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        # optional QueueTrace that records the queue length paths
+        self.trace = trace
+        # optional SimulationProfiler, its report is saved in profile_report at the end of a run
+        self.profiler = profiler
 
     def initialize(self):
-        self.stations = [Station(i) for i in range(self.n_stations)]
+        self.stations = [Station(i, self.service_limits[i], self.warmup) for i in range(self.n_stations)]
         self.rover_station = self.initial_station
         self.time = 0.0
 
@@ -126,6 +147,15 @@ class Simulation(ABC):
     def current_station(self):
         return self.stations[self.rover_station]
 
+    # Identifies the input parameters and settings of the simulation, so results of the same scenario can be grouped
+    @property
+    def scenario(self):
+        scenario_hash = hashlib.sha1()
+        for values in [parameters.arrival_rates, parameters.expected_service_times, parameters.expected_switchover_times,
+                       parameters.transition_matrix, self.service_limits, [self.warmup]]:
+            scenario_hash.update(array(values, dtype=np.float64).tobytes())
+        return scenario_hash.hexdigest()[:16]
+
     def handleCustomer(self):
         customer = self.current_station.next_customer()
         self.time += self.current_station.service_time()
@@ -133,8 +163,7 @@ class Simulation(ABC):
         self.stations[self.rover_station].results.registerWaitingTime(customer.getWaitingTime(self.time), self.time)
 
         # select queue to move to
-        nextQueue = random.choices(range(parameters.n+1), weights=parameters.transition_matrix[self.rover_station])
-        nextStation = nextQueue[0]-1
+        nextStation = self.chooseNextStation()
 
         # add customer to next queue or let him leave the system
         if (nextStation != -1):
@@ -142,6 +171,11 @@ class Simulation(ABC):
         else:
             self.stations[self.rover_station].handleExit(customer, self.time)
 
+    # Returns the index of the next station of a customer, or -1 if the customer leaves the system
+    def chooseNextStation(self):
+        nextQueue = random.choices(range(parameters.n+1), weights=parameters.transition_matrix[self.rover_station])
+        return nextQueue[0]-1
+
     def nextStation(self):
         self.time += parameters.switchover_time(self.rover_station)
         self.stations[self.rover_station].results.registerCycleTime(self.time)
@@ -149,13 +183,67 @@ class Simulation(ABC):
 
     def run(self):
         self.initialize()
+        self.next_checkpoint = self.checkpoint_interval
+        return self.proceed()
+
+    # Runs the simulation from its current state until the duration has been reached
+    def proceed(self):
+        if self.profiler is not None:
+            self.profiler.attach(self)
         try:
             while True:
                 self.handleQueue()
                 self.nextStation()
+                self.checkCheckpoint()
         except OutOfTimeError:
+            if self.profiler is not None:
+                self.profiler.detach(self)
+                self.profile_report = self.profiler.report()
             return self.showResults()
 
+    def checkCheckpoint(self):
+        if self.checkpoint_file is None or self.time < self.next_checkpoint:
+            return
+        self.saveCheckpoint(self.checkpoint_file)
+        while self.next_checkpoint <= self.time:
+            self.next_checkpoint += self.checkpoint_interval
+
+    # Saves the complete state of the simulation, including the state of the random number generators.
+    # Checkpoints are only taken when the rover switches stations, so no customer is being served.
+    def saveCheckpoint(self, file):
+        state = {
+            'simulation': self,
+            'random': random.getstate(),
+            'numpy': np.random.get_state(),
+            'next_customer_id': Customer.next_id
+        }
+        # the profiler wraps methods of the simulation, which cannot be pickled
+        if self.profiler is not None:
+            self.profiler.detach(self)
+
+        # write to a temporary file first, so a crash while writing does not destroy the previous checkpoint
+        with gzip.open(f'{file}.tmp', 'wb', compresslevel=1) as checkpoint:
+            pickle.dump(state, checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{file}.tmp', file)
+
+        if self.profiler is not None:
+            self.profiler.attach(self)
+
+    # Continues a simulation from a checkpoint. If a duration is given, the simulation is extended (or shortened) to it.
+    @staticmethod
+    def resume(file, duration=None):
+        with gzip.open(file, 'rb') as checkpoint:
+            state = pickle.load(checkpoint)
+
+        simulation = state['simulation']
+        random.setstate(state['random'])
+        np.random.set_state(state['numpy'])
+        Customer.next_id = state['next_customer_id']
+
+        if duration is not None:
+            simulation.duration = duration
+        return simulation.proceed()
+
     def set_time(self, value):
         self._time = value
         self.checkTime()
@@ -166,6 +254,8 @@ class Simulation(ABC):
     def checkTime(self):
         # save queue length
         [station.saveQueueLength(self.time) for station in self.stations]
+        if self.trace is not None:
+            [self.trace.record(self.time, station.position, station.q_length) for station in self.stations]
 
         # check for arrivals
         [station.checkArrival(self.time) for station in self.stations]
@@ -224,15 +314,15 @@ class Policy3(Simulation):
 
 # %% define station class
 class Station:
-    def __init__(self, position):
+    def __init__(self, position, service_limit=None, warmup=None):
         self.position = position
         self.queue = Queue()
         self.next_arrival = 0.0
         self.arrival_dist = stats.expon(scale=1/parameters.arrival_rates[position])
-        self.service_limit = parameters.limited_service_constants[position]
+        self.service_limit = parameters.limited_service_constants[position] if service_limit is None else service_limit
         self.service_time = partial(parameters.service_time, position)
         self.calcNextArrival()
-        self.results = StationResults()
+        self.results = StationResults(warmup)
 
     @property
     def q_length(self):
@@ -268,11 +358,28 @@ class Station:
         print(f"Queue {self.position+1}: ", end='')
         print([cust for cust in list(self.queue.queue)])
 
+    # The queue (it contains locks) and the distributions cannot be pickled, so they are rebuilt when loading
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['queue'] = list(self.queue.queue)
+        del state['arrival_dist']
+        del state['service_time']
+        return state
+
+    def __setstate__(self, state):
+        customers = state.pop('queue')
+        self.__dict__.update(state)
+        self.queue = Queue()
+        [self.queue.put(customer) for customer in customers]
+        self.arrival_dist = stats.expon(scale=1/parameters.arrival_rates[self.position])
+        self.service_time = partial(parameters.service_time, self.position)
+
 # %% define station results class
 class StationResults:
     STEADY_STATE_BOUNDARY = 20000
 
-    def __init__(self):
+    def __init__(self, warmup=None):
+        self.warmup = self.STEADY_STATE_BOUNDARY if warmup is None else warmup
         self.waiting_times = []
         self.waiting_time_moments = []
         self.queue_lengths = []
@@ -282,21 +389,21 @@ class StationResults:
         self.cycle_times = []
 
     def registerWaitingTime(self, waiting_time, time):
-        if time > self.STEADY_STATE_BOUNDARY:
+        if time > self.warmup:
             self.waiting_times.append(waiting_time)
             self.waiting_time_moments.append(time)
 
     def registerQueueLength(self, queue_length, time):
-        if time > self.STEADY_STATE_BOUNDARY:
+        if time > self.warmup:
             self.queue_lengths.append(queue_length)
             self.queue_length_times.append(time)
 
     def registerSojournTime(self, sojourn_time, time):
-        if time > self.STEADY_STATE_BOUNDARY:
+        if time > self.warmup:
             self.sojourn_times.append(sojourn_time)
 
     def registerCycleTime(self, time):
-        if time > self.STEADY_STATE_BOUNDARY:
+        if time > self.warmup:
             self.cycle_points.append(time)
 
     def calculateCycleTimes(self):
@@ -326,6 +433,212 @@ class StationResults:
     def getVarianceCycleTime(self):
         return np.var(self.cycle_times)
 
+    # Arrays are a lot more compact in a checkpoint than lists of python numbers
+    def __getstate__(self):
+        return {key: np.asarray(value) for key, value in self.__dict__.items()}
+
+    def __setstate__(self, state):
+        self.__dict__.update({key: value.tolist() for key, value in state.items()})
+        self.cycle_times = np.asarray(self.cycle_times)
+
+# %% define queue trace class
+class QueueTrace:
+    '''
+    Records the queue length paths of all stations. Only the change points are stored, as (time, station, length)
+    records in a preallocated array. When the array is full it is appended to a binary file, which is memory mapped
+    when replaying, so long paths do not have to fit in memory.
+    '''
+    DTYPE = np.dtype([('time', np.float64), ('station', np.uint16), ('length', np.uint32)])
+
+    def __init__(self, n_stations, file='queue_trace.bin', buffer_size=65536):
+        self.file = file
+        self.buffer = np.empty(buffer_size, dtype=self.DTYPE)
+        self.size = 0
+        self.flushed = 0
+        self.last_lengths = [-1] * n_stations
+        open(self.file, 'wb').close()
+
+    def record(self, time, station, length):
+        if self.last_lengths[station] == length:
+            return
+        self.last_lengths[station] = length
+
+        if self.size == len(self.buffer):
+            self.flush()
+        self.buffer[self.size] = (time, station, length)
+        self.size += 1
+
+    def flush(self):
+        with open(self.file, 'ab') as trace_file:
+            self.buffer[:self.size].tofile(trace_file)
+        self.flushed += self.size
+        self.size = 0
+
+    def records(self):
+        self.flush()
+        if self.flushed == 0:
+            return np.empty(0, dtype=self.DTYPE)
+        return np.memmap(self.file, dtype=self.DTYPE, mode='r', shape=(self.flushed,))
+
+    # Returns the queue length path of each station in the time window [start, end] as (times, lengths) arrays.
+    # The path starts with the queue length at the start of the window.
+    def replay(self, start=0.0, end=math.inf):
+        records = self.records()
+        times = records['time']
+        first = np.searchsorted(times, start, side='right')
+        last = np.searchsorted(times, end, side='right')
+        window = records[first:last]
+
+        paths = {}
+        for station in range(len(self.last_lengths)):
+            in_window = window[window['station'] == station]
+            previous = self.last_record_before(records, first, station)
+            initial_length = 0 if previous is None else previous['length']
+            paths[station] = (
+                np.concatenate(([start], in_window['time'])),
+                np.concatenate(([initial_length], in_window['length'])))
+        return paths
+
+    # Searches backwards in blocks, so only the part of the file before the window is read
+    def last_record_before(self, records, index, station, block_size=4096):
+        while index > 0:
+            block = records[max(0, index - block_size):index]
+            matches = np.flatnonzero(block['station'] == station)
+            if len(matches) > 0:
+                return block[matches[-1]]
+            index -= block_size
+        return None
+
+    # Records that were flushed after a checkpoint was taken are removed when the checkpoint is loaded
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        with open(self.file, 'ab') as trace_file:
+            trace_file.truncate(self.flushed * self.DTYPE.itemsize)
+
+# %% define simulation profiler class
+class SimulationProfiler:
+    '''
+    Opt-in instrumentation of a simulation. It wraps the methods of the simulation and its stations, counts every call
+    and measures the wall time of every sample_rate-th call, which keeps the overhead low.
+    Measured times are inclusive: handleCustomer also contains the checkTime call caused by advancing the clock.
+    '''
+    SIMULATION_PHASES = {
+        'checkTime': 'clock update',
+        'handleCustomer': 'service',
+        'nextStation': 'switchover',
+        'chooseNextStation': 'routing variate'
+    }
+    STATION_PHASES = {
+        'calcNextArrival': 'arrival variate',
+        'service_time': 'service variate',
+        'handleExit': 'exit'
+    }
+    RESULTS_PHASES = ['registerWaitingTime', 'registerQueueLength', 'registerSojournTime', 'registerCycleTime']
+    EVENTS = ['arrival variate', 'service', 'switchover', 'exit']
+
+    def __init__(self, sample_rate=64, json_file=None):
+        self.sample_rate = sample_rate
+        self.json_file = json_file
+        self.counts = {}
+        self.sampled_calls = {}
+        self.sampled_times = {}
+        self.busy_times = {}
+        self.wall_time = 0.0
+        self.simulated_time = 0.0
+        self.wrapped = []
+
+    def attach(self, simulation):
+        for name, phase in self.SIMULATION_PHASES.items():
+            self.wrap(simulation, name, phase)
+        for station in simulation.stations:
+            for name, phase in self.STATION_PHASES.items():
+                self.wrap(station, name, phase, station.position)
+            for name in self.RESULTS_PHASES:
+                self.wrap(station.results, name, 'statistics', station.position)
+
+        self.start_wall_time = time.perf_counter()
+        self.start_simulated_time = simulation.time
+
+    def detach(self, simulation):
+        self.wall_time += time.perf_counter() - self.start_wall_time
+        self.simulated_time += simulation.time - self.start_simulated_time
+
+        # restore the original instance attributes, or remove the wrapper so the class method is visible again
+        for obj, name, original in self.wrapped:
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self.wrapped = []
+
+    def wrap(self, obj, name, phase, station=None):
+        function = getattr(obj, name)
+        self.wrapped.append((obj, name, obj.__dict__.get(name)))
+        key = (phase, station)
+        for counter in [self.counts, self.sampled_calls, self.sampled_times]:
+            counter.setdefault(key, 0)
+        counts, sampled_calls, sampled_times, sample_rate = self.counts, self.sampled_calls, self.sampled_times, self.sample_rate
+
+        def profiled(*args):
+            counts[key] += 1
+            if counts[key] % sample_rate:
+                return function(*args)
+            start = time.perf_counter()
+            result = function(*args)
+            sampled_times[key] += time.perf_counter() - start
+            sampled_calls[key] += 1
+            return result
+
+        # the service times are also summed, for the load of the stations
+        if name == 'service_time':
+            def profiled_service_time(*args):
+                service_time = profiled(*args)
+                self.busy_times[station] = self.busy_times.get(station, 0.0) + service_time
+                return service_time
+            wrapper = profiled_service_time
+        else:
+            wrapper = profiled
+
+        setattr(obj, name, wrapper)
+
+    def report(self):
+        phases = {}
+        for (phase, station), count in self.counts.items():
+            totals = phases.setdefault(phase, {'calls': 0, 'sampled_calls': 0, 'sampled_time': 0.0})
+            totals['calls'] += count
+            totals['sampled_calls'] += self.sampled_calls[(phase, station)]
+            totals['sampled_time'] += self.sampled_times[(phase, station)]
+
+        for totals in phases.values():
+            mean_time = totals['sampled_time'] / totals['sampled_calls'] if totals['sampled_calls'] > 0 else 0.0
+            totals['mean_time'] = mean_time
+            totals['estimated_time'] = mean_time * totals['calls']
+            totals['estimated_share'] = totals['estimated_time'] / self.wall_time if self.wall_time > 0 else 0.0
+
+        events = {event: phases.get(event, {'calls': 0})['calls'] for event in self.EVENTS}
+        stations = sorted({station for _, station in self.counts if station is not None})
+
+        report = {
+            'wall_time': self.wall_time,
+            'simulated_time': self.simulated_time,
+            'events': events,
+            'events_per_second': sum(events.values()) / self.wall_time if self.wall_time > 0 else 0.0,
+            'phases': phases,
+            'stations': [{
+                'station': station,
+                'arrivals': self.counts.get(('arrival variate', station), 0),
+                'services': self.counts.get(('service variate', station), 0),
+                'exits': self.counts.get(('exit', station), 0),
+                'busy_time': self.busy_times.get(station, 0.0),
+                'load': self.busy_times.get(station, 0.0) / self.simulated_time if self.simulated_time > 0 else 0.0
+            } for station in stations]
+        }
+
+        if self.json_file is not None:
+            with open(self.json_file, 'w') as json_file:
+                json.dump(report, json_file, indent=2, default=float)
+        return report
+
 # %% define customer class
 class Customer:
     next_id = 1
@@ -353,12 +666,14 @@ class Customer:
 
 # %% define confidence interval class
 class ConfidenceInterval:
-    def __init__(self, simulation, iterations):
+    def __init__(self, simulation, iterations, store=None):
         self.simulation = simulation
         self.n_stations = simulation.n_stations
         self.duration = simulation.duration
         self.iterations = iterations
         self.mean_waiting_times = [[] for _ in range(self.n_stations)]
+        # optional ResultsStore in which the results of every run are saved
+        self.store = store
 
     def calculate(self):
         # run simulations
@@ -366,6 +681,8 @@ class ConfidenceInterval:
             print(f"Run {i}")
             res = self.simulation.run()
             [self.mean_waiting_times[j].append(res['E[W]'][j]) for j in range(self.n_stations)]
+            if self.store is not None:
+                self.store.append(self.simulation, res, replication=i)
         
         # calculate confidence intervals of results
         self.intervals = [stats.t.interval(0.95, len(means)-1, loc=np.mean(means), scale=stats.sem(means)) for means in self.mean_waiting_times]
@@ -377,39 +694,195 @@ class ConfidenceInterval:
             [print(f"{interval}", file=text_file) for interval in self.intervals]
         [print(interval) for interval in self.intervals]
 
+# %% define results store class
+class ResultsStore:
+    '''
+    Stores the per station results of simulation runs as a columnar dataset: a directory with one .npz file per run,
+    containing one array per column. Results can be loaded with filters and confidence intervals can be recomputed,
+    without running the simulations again.
+    A run is identified by its discipline, scenario, seed, replication and duration, and its file is named after them,
+    so storing a run again replaces it instead of adding the same rows twice. Runs without a seed are stored with seed
+    NO_SEED, and are all kept.
+    '''
+    NO_SEED = -1
+    RUN_COLUMNS = ['discipline', 'scenario', 'seed', 'replication', 'duration']
+    KEY_COLUMNS = ['discipline', 'scenario', 'seed', 'replication', 'duration', 'station']
+
+    def __init__(self, directory='results'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, simulation, results, replication=0):
+        n = len(results)
+        columns = {
+            'discipline': np.full(n, type(simulation).__name__),
+            'scenario': np.full(n, simulation.scenario),
+            'seed': np.full(n, self.NO_SEED if simulation.seed is None else simulation.seed, dtype=np.int64),
+            'replication': np.full(n, replication),
+            'duration': np.full(n, simulation.duration, dtype=np.float64),
+            'station': np.arange(n)
+        }
+        for metric in results.columns:
+            columns[metric] = results[metric].to_numpy(dtype=np.float64)
+
+        run = tuple(columns[column][0].item() for column in self.RUN_COLUMNS)
+        np.savez(self.part_file(run if columns['seed'][0] != self.NO_SEED else None), **columns)
+
+    # The file of a run, or a new file if the run is None
+    def part_file(self, run=None):
+        if run is not None:
+            return os.path.join(self.directory, f'part-{hashlib.sha1(repr(run).encode()).hexdigest()[:16]}.npz')
+
+        part = len(self.parts())
+        while os.path.exists(os.path.join(self.directory, f'part-{part:06d}.npz')):
+            part += 1
+        return os.path.join(self.directory, f'part-{part:06d}.npz')
+
+    def parts(self):
+        return sorted(os.path.join(self.directory, file) for file in os.listdir(self.directory) if file.endswith('.npz'))
+
+    # Loads the rows for which every filter column equals the given value (or is in the given list of values).
+    # Only the filter columns are read for parts without matching rows.
+    def load(self, columns=None, **filters):
+        frames = []
+        for part in self.parts():
+            with np.load(part) as data:
+                mask = np.ones(len(data['station']), dtype=bool)
+                for column, value in filters.items():
+                    mask &= np.isin(data[column], value)
+                if not mask.any():
+                    continue
+                frames.append(pd.DataFrame({column: data[column][mask] for column in (columns or data.files)}))
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns or self.KEY_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def confidence_intervals(self, metric='E[W]', by=('discipline', 'scenario', 'station'), confidence=0.95, **filters):
+        data = self.load(columns=list(by) + [metric], **filters)
+        rows = []
+        for key, values in data.groupby(list(by))[metric]:
+            mean = np.mean(values)
+            low, high = stats.t.interval(confidence, len(values)-1, loc=mean, scale=stats.sem(values))
+            rows.append((*key, len(values), mean, low, high))
+        return pd.DataFrame(rows, columns=list(by) + ['n', 'mean', 'low', 'high'])
+
+# %% Define class for optimizing the limited service constants of policy 2
+# Runs a single policy 2 simulation and returns its weighted mean waiting time.
+# This is a module level function, so it can be sent to worker processes.
+def evaluate_service_limits(service_limits, weights, seed, duration, warmup):
+    simulation = Policy2(n_stations=parameters.n, duration=duration, seed=seed, service_limits=service_limits, warmup=warmup)
+    mean_waiting_times = simulation.run()['E[W]'].to_numpy()
+
+    # a station without any served customers cannot be judged, so we rank it last
+    if np.isnan(mean_waiting_times).any():
+        return math.inf
+    return dot(weights, mean_waiting_times)
+
+class ServiceLimitOptimizer:
+    '''
+    Searches the limited service constants (k-values) of policy 2 that minimize the weighted mean waiting time.
+    Candidates are compared with successive halving: all of them are simulated for a short duration, the best
+    1/eta of them survive and are simulated eta times longer, until one candidate remains.
+    Every candidate uses the same seeds (common random numbers), so differences between candidates are caused
+    by the k-values rather than by noise.
+    The runs are done in worker processes only if they are started with fork, otherwise they are done one by one.
+    '''
+    def __init__(self, candidates=None, n_candidates=32, max_limit=8, weights=None, eta=2,
+                 replications=3, initial_duration=5000, warmup=1000, seed=69, workers=None):
+        self.max_limit = max_limit
+        self.eta = eta
+        self.replications = replications
+        self.initial_duration = initial_duration
+        self.warmup = warmup
+        self.seed = seed
+        self.workers = workers
+
+        # By default the waiting times are weighted by the total arrival rate of each station,
+        # which gives the mean waiting time per visit of a customer
+        if weights is None:
+            weights = TheoreticCalculations().arrival_rates
+        self.weights = array(weights) / np.sum(weights)
+
+        self.candidates = self.generate_candidates(n_candidates) if candidates is None else [tuple(c) for c in candidates]
+
+    def generate_candidates(self, n_candidates):
+        rng = np.random.default_rng(self.seed)
+        candidates = [tuple(int(k) for k in parameters.limited_service_constants)]
+        while len(candidates) < n_candidates:
+            candidate = tuple(int(k) for k in rng.integers(1, self.max_limit + 1, size=parameters.n))
+            if candidate not in candidates:
+                candidates.append(candidate)
+        return candidates
+
+    def evaluate(self, candidates, duration):
+        seeds = [self.seed + r for r in range(self.replications)]
+        jobs = [(candidate, seed) for candidate in candidates for seed in seeds]
+        args = (
+            [candidate for candidate, _ in jobs],
+            [self.weights] * len(jobs),
+            [seed for _, seed in jobs],
+            [duration] * len(jobs),
+            [self.warmup] * len(jobs))
+
+        # this file is a cell script, so workers that are started with spawn (the default on Windows and macOS) would
+        # run all cells again, and cannot import evaluate_service_limits from an interactive session
+        if self.workers == 1 or multiprocessing.get_start_method() != 'fork':
+            results = list(map(evaluate_service_limits, *args))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(evaluate_service_limits, *args))
+
+        results = array(results).reshape((len(candidates), self.replications))
+        return results.mean(axis=1)
+
+    def optimize(self):
+        survivors = list(self.candidates)
+        duration = self.initial_duration
+        history = []
+
+        round_nr = 0
+
+        while len(survivors) > 1:
+            round_nr += 1
+            print(f'Round {round_nr}: {len(survivors)} candidates, duration {duration}')
+            scores = self.evaluate(survivors, duration)
+            history += [(round_nr, duration, candidate, score) for candidate, score in zip(survivors, scores)]
+
+            # only the best 1/eta of the candidates get a longer run
+            ranking = np.argsort(scores, kind='stable')
+            survivors = [survivors[i] for i in ranking[:math.ceil(len(survivors) / self.eta)]]
+            duration *= self.eta
+
+        self.best = survivors[0]
+        self.history = pd.DataFrame(history, columns=['round', 'duration', 'service_limits', 'weighted E[W]'])
+        return self.best, self.history
+
 
 # %% run simulations
 parameters = InputParameters()
 TheoreticCalculations().print_values()
 
 # Generates paths for the queues
-def generate_q_paths():
-    # We want the transient behaviour
-    steady_state_boundary = StationResults.STEADY_STATE_BOUNDARY
-    StationResults.STEADY_STATE_BOUNDARY = 0
-
+def generate_q_paths(duration=200):
+    # We want the transient behaviour, so the paths are recorded by a trace instead of the (steady state) results
     for i in range(3):
-        simulation = [Policy1, Policy2, Policy3][i](n_stations=parameters.n, duration=200)
+        trace = QueueTrace(parameters.n, f'queue_trace_{i+1}.bin')
+        simulation = [Policy1, Policy2, Policy3][i](n_stations=parameters.n, duration=duration, trace=trace)
         simulation.run()
+        paths = trace.replay(0, duration)
         plt.subplots(figsize=(15,5))
 
         for s in range(parameters.n):
-            station = simulation.stations[s]
             color = ['red', 'blue', 'green', 'black', 'cyan', 'magenta'][s]
-
-            lengths = station.results.queue_lengths
-            times = station.results.queue_length_times
-
-            plt.step(times, lengths, color=color, label=f'Station {s+1}')
+            times, lengths = paths[s]
+            plt.step(times, lengths, where='post', color=color, label=f'Station {s+1}')
 
         plt.xlabel('Time')
         plt.ylabel('Queue length (floor)')
         plt.title(f'Queue lengths with policy {i+1}')
         plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
         plt.savefig(f'queue_lengths_{i+1}')
-    
-    # reset back to original value
-    StationResults.STEADY_STATE_BOUNDARY = steady_state_boundary
 
 generate_q_paths()
 
@@ -449,15 +922,25 @@ plt.show()
 
 # %% calculate confidence intervals
 
-ci1 = ConfidenceInterval(Policy1(n_stations=parameters.n, duration=100000), iterations=50)
+store = ResultsStore('results')
+
+ci1 = ConfidenceInterval(Policy1(n_stations=parameters.n, duration=100000), iterations=50, store=store)
 ci1.calculate()
 ci1.printResults("Output_discipline1.txt")
 
-ci2 = ConfidenceInterval(Policy2(n_stations=parameters.n, duration=100000), iterations=50)
+ci2 = ConfidenceInterval(Policy2(n_stations=parameters.n, duration=100000), iterations=50, store=store)
 ci2.calculate()
 ci2.printResults("Output_discipline2.txt")
 
-ci3 = ConfidenceInterval(Policy3(n_stations=parameters.n, duration=100000), iterations=50)
+ci3 = ConfidenceInterval(Policy3(n_stations=parameters.n, duration=100000), iterations=50, store=store)
 ci3.calculate()
 ci3.printResults("Output_discipline3.txt")
+
+# the stored results can be read back without running the simulations again
+print(store.confidence_intervals('E[W]'))
+# %% optimize the limited service constants of discipline 2
+optimizer = ServiceLimitOptimizer()
+best_limits, history = optimizer.optimize()
+print(f'Best limited service constants: {best_limits}')
+print(history.sort_values(['round', 'weighted E[W]']))
 # %%
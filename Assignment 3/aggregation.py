@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import stats
+
+'''
+A DayAggregate combines per-minute results (key -> array with a value per minute) of simulated days.
+For every key it keeps a running mean and sum of squared deviations (Welford's algorithm), so adding a day costs
+O(minutes) no matter how many days were added before, and means, standard deviations and t-based confidence bands
+per minute are available at any moment. With keep_days, the day by minute array of every key is kept as well.
+'''
+class DayAggregate:
+    def __init__(self, minutes, keep_days=False):
+        self.minutes = np.asarray(minutes)
+        self.keep_days = keep_days
+        self.counts = { }
+        self.means = { }
+        self.squares = { }
+        self.cubes = { }
+
+    def add_day(self, day_data):
+        for key, values in day_data.items():
+            values = np.asarray(values, dtype=np.float64)
+            if key not in self.counts:
+                self.counts[key] = 0
+                self.means[key] = np.zeros(len(self.minutes))
+                self.squares[key] = np.zeros(len(self.minutes))
+                self.cubes[key] = np.empty((16, len(self.minutes))) if self.keep_days else None
+
+            self.counts[key] += 1
+            delta = values - self.means[key]
+            self.means[key] += delta / self.counts[key]
+            self.squares[key] += delta * (values - self.means[key])
+
+            if self.keep_days:
+                self.store_day(key, values)
+
+    # Rows are added to a preallocated array, which doubles in size when it is full
+    def store_day(self, key, values):
+        cube = self.cubes[key]
+        day = self.counts[key] - 1
+        if day == len(cube):
+            cube = self.cubes[key] = np.concatenate((cube, np.empty(cube.shape)))
+        cube[day] = values
+
+    def keys(self):
+        return self.counts.keys()
+
+    def n_days(self, key):
+        return self.counts[key]
+
+    def mean(self, key):
+        return self.means[key]
+
+    def std(self, key):
+        if self.counts[key] < 2:
+            return np.full(len(self.minutes), np.nan)
+        return np.sqrt(self.squares[key] / (self.counts[key] - 1))
+
+    # Returns the lower and upper bound of the confidence interval of the mean, for every minute
+    def confidence_band(self, key, confidence=0.95):
+        n = self.counts[key]
+        half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * self.std(key) / np.sqrt(n) if n > 1 else np.nan
+        return self.means[key] - half_width, self.means[key] + half_width
+
+    # The day by minute array of a key (only if keep_days is set)
+    def days(self, key):
+        if not self.keep_days:
+            raise ValueError('The days were not kept, pass keep_days=True')
+        return self.cubes[key][:self.counts[key]]
+
+    # The means per key as lists of (minute, mean) tuples
+    def series(self):
+        return {key: list(zip(self.minutes, self.means[key])) for key in self.keys()}
+
+    def bands(self, confidence=0.95):
+        return {key: self.confidence_band(key, confidence) for key in self.keys()}
+
+# Half width of the t-based confidence interval of the mean of the values, relative to the mean
+def relative_precision(values, confidence=0.95):
+    n = len(values)
+    if n < 2:
+        return np.inf
+    mean = np.mean(values)
+    half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * np.std(values, ddof=1) / np.sqrt(n)
+    if mean == 0:
+        return 0.0 if half_width == 0 else np.inf
+    return half_width / abs(mean)
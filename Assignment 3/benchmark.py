@@ -0,0 +1,173 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from multiprocessing import Pool
+from event_handlers import *
+from observers import *
+from replication import summarize_day
+
+# The resource module is only available on Unix, without it the peak resident memory is not measured
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ['setup', 'arrivals', 'simulate', 'analysis']
+
+# The resources of the site that are multiplied by the staff scale
+SCALED_RESOURCES = ['receptionists', 'doctors', 'nurses', 'beds_plasma', 'beds_blood']
+
+# A FES that measures the time spent in enqueue and pop
+class TimedFES(FES):
+    def __init__(self):
+        super().__init__()
+        self.elapsed = 0.0
+
+    def enqueue(self, event, priority=0):
+        start = time.perf_counter()
+        super().enqueue(event, priority)
+        self.elapsed += time.perf_counter() - start
+
+    def pop(self):
+        start = time.perf_counter()
+        event = super().pop()
+        self.elapsed += time.perf_counter() - start
+        return event
+
+# Peak resident memory of this process in MB, or None if it cannot be measured
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+def scenario_config(arrival_scale, staff_scale):
+    config = {resource: round(DEFAULT_CONFIG[resource] * staff_scale) for resource in SCALED_RESOURCES}
+    return {**config, 'arrival_scale': arrival_scale}
+
+# Runs the stages of a simulated day, and returns the time (or the peak of the traced memory) of every stage
+def run_stages(config, seed, trace_memory=False):
+    measurements = { }
+    result = { }
+
+    def stage(name, function):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = function()
+        measurements[name] = tracemalloc.get_traced_memory()[1] if trace_memory else time.perf_counter() - start
+        if trace_memory:
+            tracemalloc.stop()
+        return value
+
+    site = stage('setup', lambda: create_site(config, seed))
+    stage('arrivals', site.add_arrivals)
+
+    observers = create_observers(site)
+    event_q = TimedFES()
+    simulator = Simulator(site.system, observers=observers.values(), keep_events=False, event_q=event_q)
+    stage('simulate', simulator.simulate)
+    stage('analysis', lambda: summarize_day(site, simulator, observers))
+
+    result['donors'] = site.n_donors
+    result['events'] = simulator.n_events
+    result['actions'] = simulator.n_actions
+    result['fes'] = event_q.elapsed
+    return measurements, result
+
+# Benchmarks a scenario, this is executed in a new worker process so the peak memory is of this scenario only
+def benchmark_scenario(task):
+    arrival_scale, staff_scale, repeats, seed, trace_memory = task
+    config = scenario_config(arrival_scale, staff_scale)
+
+    # the fastest of the repeats is the least disturbed by other processes
+    runs = [run_stages(config, seed) for _ in range(repeats)]
+    best = min(runs, key=lambda run: run[0]['simulate'])
+    times, result = best
+
+    benchmark = {
+        'arrival_scale': arrival_scale,
+        'staff_scale': staff_scale,
+        'repeats': repeats,
+        **result,
+        'seconds': times,
+        'events_per_sec': result['events'] / times['simulate'],
+        'actions_per_sec': result['actions'] / times['simulate'],
+        'fes_share': result['fes'] / times['simulate'],
+        'peak_rss_mb': peak_rss_mb()
+    }
+    if trace_memory:
+        benchmark['peak_traced_mb'] = {name: peak / 2**20 for name, peak in run_stages(config, seed, True)[0].items()}
+    return benchmark
+
+'''
+Benchmarks the blood bank model at several whole blood arrival scales, with the staff and beds multiplied by the same
+factor (or by the given staff scales). For every scenario it measures the time of every stage (setup, arrivals,
+simulate and analysis), events and actions per second, the share of the simulation spent in the FES, the peak
+resident memory and (with trace_memory) the peak traced memory of every stage.
+The results are saved as JSON, and compare() shows the ratios of two result files.
+'''
+def run_benchmarks(arrival_scales=(1, 10, 100), staff_scales=None, repeats=3, seed=1, trace_memory=True, file=None):
+    staff_scales = arrival_scales if staff_scales is None else staff_scales
+    if len(staff_scales) != len(arrival_scales):
+        raise ValueError(f'{len(arrival_scales)} arrival scales but {len(staff_scales)} staff scales')
+    tasks = [(arrival_scale, staff_scale, repeats, seed, trace_memory)
+             for arrival_scale, staff_scale in zip(arrival_scales, staff_scales)]
+
+    benchmarks = []
+    for task in tasks:
+        with Pool(1, maxtasksperchild=1) as pool:
+            benchmark = pool.map(benchmark_scenario, [task])[0]
+        print_benchmark(benchmark)
+        benchmarks.append(benchmark)
+
+    results = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': benchmarks
+    }
+    if file is not None:
+        with open(file, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+def print_benchmark(benchmark):
+    seconds = ', '.join(f'{name} {benchmark["seconds"][name]:.3f}s' for name in STAGES)
+    rss = '' if benchmark['peak_rss_mb'] is None else f', peak RSS {benchmark["peak_rss_mb"]:.0f} MB'
+    print(f'{benchmark["arrival_scale"]}x arrivals, {benchmark["staff_scale"]}x staff: {benchmark["donors"]} donors, '
+          f'{benchmark["events_per_sec"]:.0f} events/s, {benchmark["actions_per_sec"]:.0f} actions/s, '
+          f'FES {100 * benchmark["fes_share"]:.1f}%{rss}\n  {seconds}')
+
+# Prints the ratio (new / old) of the stage times, throughput and memory of the scenarios in both result files
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = {(b['arrival_scale'], b['staff_scale']): b for b in json.load(f)['benchmarks']}
+    with open(new_file) as f:
+        new = {(b['arrival_scale'], b['staff_scale']): b for b in json.load(f)['benchmarks']}
+
+    for scenario in sorted(old.keys() & new.keys()):
+        a, b = old[scenario], new[scenario]
+        ratios = {name: b['seconds'][name] / a['seconds'][name] for name in STAGES}
+        ratios['events_per_sec'] = b['events_per_sec'] / a['events_per_sec']
+        if a['peak_rss_mb'] is not None and b['peak_rss_mb'] is not None:
+            ratios['peak_rss_mb'] = b['peak_rss_mb'] / a['peak_rss_mb']
+        print(f'{scenario[0]}x arrivals, {scenario[1]}x staff: ' + ', '.join(f'{k} {v:.2f}' for k, v in ratios.items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the blood bank model at several arrival scales')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--staff-scales', type=float, nargs='+')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the memory of every stage')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='a previous result file to compare with')
+    args = parser.parse_args()
+
+    run_benchmarks(args.scales, args.staff_scales, args.repeats, trace_memory=not args.no_memory, file=args.output)
+    if args.compare:
+        compare(args.compare, args.output)
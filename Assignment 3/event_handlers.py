@@ -1,143 +1,158 @@
+from functools import partial
 from system_definition import *
 
 '''
-Each event/action handler and policy has 3 arguments:
+Each event/action handler and policy has 4 arguments:
+site: BloodCollectionSite     | The site whose system is simulated
 time: Float                   | The current simulation time
 action: Action                | The action that triggered the call
 action_builder: ActionBuilder | A helper object that lets you specify which actions and events need to happen 
 
-Additionally, each policy has as first argument the staff member which is executing the policy
+Additionally, each policy has as second argument the staff member which is executing the policy
+The site is bound to the handlers and policies when they are registered, see register_handlers
 '''
 # Action handlers
-def on_arrive(time, action, action_builder):
-    action_builder.enter(registration_q).build()
-    action_builder.enter(registration_line).build()
+def on_arrive(site, time, action, action_builder):
+    action_builder.enter(site.registration_q).build()
+    action_builder.enter(site.registration_line).build()
 
-def on_registration_leave(time, action, builder):
-    builder.enter(question_room).build()
-    builder.leave(question_room).at(time + dist_questionnaire.rvs()).build()
+def on_registration_leave(site, time, action, builder):
+    builder.enter(site.question_room).build()
+    builder.leave(site.question_room).at(time + site.dist_questionnaire.rvs()).build()
 
-def on_questionnaire_leave(time, action, builder):
-    builder.enter(pre_interview_room).build()
-    builder.enter(interview_q).build()
+def on_questionnaire_leave(site, time, action, builder):
+    builder.enter(site.pre_interview_room).build()
+    builder.enter(site.interview_q).build()
 
-def registration_policy(receptionist, time, action, action_builder):
-    if registration_q.is_empty():
+def registration_policy(site, receptionist, time, action, action_builder):
+    if site.registration_q.is_empty():
         return
 
-    donor = registration_q.first()
+    donor = site.registration_q.first()
     action_builder.use_donor(donor)
 
     action_builder.occupy_staff(receptionist).build()
-    action_builder.leave(registration_q).build()
+    action_builder.leave(site.registration_q).build()
     (action_builder
-        .leave(registration_line)
+        .leave(site.registration_line)
         .free_staff(receptionist)
-        .at(time + dist_registration.rvs())
+        .at(time + site.dist_registration.rvs())
         .build())
 
-def on_pre_donation_enter(time, action, action_builder):
-    global available_beds_plasma
-    global available_beds_blood
-
-    # check if there available beds and if so, occupy them
-    if action.donor.type == Donor.PLASMA and available_beds_plasma > 0:
-        available_beds_plasma -= 1
-    elif action.donor.type == Donor.WHOLE_BLOOD and available_beds_blood > 0:
-        available_beds_blood -= 1
-    else:
-        # no bed is available, so we join the donation_q and wait
-        action_builder.enter(donation_q).build()
+def on_pre_donation_enter(site, time, action, action_builder):
+    # occupy a bed if there is one available, otherwise we join the donation_q and wait for a bed of our type
+    if not site.beds.acquire(action.donor.type, time, action.donor):
+        action_builder.enter(site.donation_q).build()
         return
 
-    action_builder.leave(pre_donation_room).build()
-    action_builder.enter(donation_room).build()
-    action_builder.enter(connect_q).build()
-
-def on_donor_leave(time, action, action_builder):
-    global available_beds_plasma
-    global available_beds_blood
+    action_builder.leave(site.pre_donation_room).build()
+    action_builder.enter(site.donation_room).build()
+    action_builder.enter(site.connect_q).build()
 
+def on_donor_leave(site, time, action, action_builder):
     # If the donor left because it is not accepted during interview, no bed will become free
     if not action.donor.accepted:
         return
 
-    # Check if there is a donor of the same type as the donor that left
-    donor = donation_q.first_of_type(action.donor.type)
+    # The bed goes to the first donor of the same type that is waiting for one, if any
+    donor = site.beds.release(action.donor.type, time)
     if donor is None:
-        if action.donor.type == Donor.PLASMA:
-            available_beds_plasma += 1
-        else:
-            available_beds_blood += 1
         return
 
     action_builder.use_donor(donor)
-    action_builder.leave(donation_q).build()
-    action_builder.leave(pre_donation_room).build()
-    action_builder.enter(donation_room).build()
-    action_builder.enter(connect_q).build()
+    action_builder.leave(site.donation_q).build()
+    action_builder.leave(site.pre_donation_room).build()
+    action_builder.enter(site.donation_room).build()
+    action_builder.enter(site.connect_q).build()
 
-def on_donation_room_leave(time, action, action_builder):
-    action_builder.leave(system).build()
+def on_donation_room_leave(site, time, action, action_builder):
+    action_builder.leave(site.system).build()
 
 # Policies
-def interview_policy(doctor, time, action, action_builder):
-    if interview_q.is_empty():
+def interview_policy(site, doctor, time, action, action_builder):
+    if site.interview_q.is_empty():
         return
 
     # plasma donors have priority, other than that its a FIFO queue
-    donor = interview_q.first()
-    for donor_ in interview_q.queue:
-        if donor_.type == Donor.PLASMA:
-            donor = donor_
-            break
-    
-    action_builder.use_donor(donor_)
+    donor = site.interview_q.first_of_type(Donor.PLASMA)
+    if donor is None:
+        donor = site.interview_q.first()
+
+    action_builder.use_donor(donor)
     action_builder.occupy_staff(doctor).build()
-    action_builder.leave(interview_q).build()
-    action_builder.leave(pre_interview_room).build()
+    action_builder.leave(site.interview_q).build()
+    action_builder.leave(site.pre_interview_room).build()
 
     # five percent chance of getting rejected
-    if np.random.random() <= 0.05:
+    if site.streams['rejection'].random() <= site.config['rejection_probability']:
         donor.accepted = False
         (action_builder
-            .leave(system)
+            .leave(site.system)
             .free_staff(doctor)
-            .at(time + dist_interview.rvs())
+            .at(time + site.dist_interview.rvs())
             .build())
     else:
         donor.accepted = True # same as its default value, but better to be explicit than implicit
         (action_builder
-            .enter(pre_donation_room)
+            .enter(site.pre_donation_room)
             .free_staff(doctor)
-            .at(time + dist_interview.rvs())
+            .at(time + site.dist_interview.rvs())
             .build())
         
-def donation_policy(nurse, time, action, action_builder):
+def donation_policy(site, nurse, time, action, action_builder):
     # Priority 1: Disconnect donor
-    if not disconnect_q.is_empty():
-        donor = disconnect_q.first()
+    if not site.disconnect_q.is_empty():
+        donor = site.disconnect_q.first()
         action_builder.use_donor(donor)
         action_builder.occupy_staff(nurse).build()
-        action_builder.leave(disconnect_q).build()
+        action_builder.leave(site.disconnect_q).build()
 
-        disconnect_finish = time + dist_disconnect.rvs()
+        disconnect_finish = time + site.dist_disconnect.rvs()
         action_builder.free_staff(nurse).at(disconnect_finish).build()
-        action_builder.leave(donation_room).at(disconnect_finish + dist_recover.rvs()).build()
+        action_builder.leave(site.donation_room).at(disconnect_finish + site.dist_recover.rvs()).build()
 
-    if not connect_q.is_empty():
+    if not site.connect_q.is_empty():
         # Priority 2: Connect plasma donor
         # Priority 3: Connect whole blood donor
-        donor = connect_q.first_of_type(Donor.PLASMA)
+        donor = site.connect_q.first_of_type(Donor.PLASMA)
         if donor is None:
-            donor = connect_q.first()
+            donor = site.connect_q.first()
 
         action_builder.use_donor(donor)
         action_builder.occupy_staff(nurse).build()
-        action_builder.leave(connect_q).build()
+        action_builder.leave(site.connect_q).build()
 
-        connect_finish = time + dist_connect.rvs()
-        donation_duration = dist_plasma.rvs() if donor.type == Donor.PLASMA else dist_whole_blood.rvs()
+        connect_finish = time + site.dist_connect.rvs()
+        donation_duration = site.dist_plasma.rvs() if donor.type == Donor.PLASMA else site.dist_whole_blood.rvs()
 
         action_builder.free_staff(nurse).at(connect_finish).build()
-        action_builder.enter(disconnect_q).at(connect_finish + donation_duration).build()
+        action_builder.enter(site.disconnect_q).at(connect_finish + donation_duration).build()
+
+# Register all event handlers and policies of a site
+def register_handlers(site):
+    system = site.system
+    system.subscribe(system.ENTER, partial(on_arrive, site))
+    system.subscribe(site.registration_line.LEAVE, partial(on_registration_leave, site))
+    system.subscribe(site.question_room.LEAVE, partial(on_questionnaire_leave, site))
+    system.subscribe(site.pre_donation_room.ENTER, partial(on_pre_donation_enter, site))
+    system.subscribe(site.donation_room.LEAVE, partial(on_donation_room_leave, site))
+    system.subscribe(system.LEAVE, partial(on_donor_leave, site))
+
+    for receptionist in site.receptionists:
+        receptionist.policy = partial(registration_policy, site)
+        receptionist.subscribe(site.registration_q.ENTER)
+
+    for doctor in site.doctors:
+        doctor.policy = partial(interview_policy, site)
+        doctor.subscribe(site.interview_q.ENTER)
+
+    for nurse in site.nurses:
+        nurse.policy = partial(donation_policy, site)
+        nurse.subscribe(site.connect_q.ENTER)
+        nurse.subscribe(site.disconnect_q.ENTER)
+
+# Builds a site with all handlers and policies registered. Every call returns a new, independent site
+def create_site(config=None, seed=None):
+    site = BloodCollectionSite(config, seed)
+    register_handlers(site)
+    return site
@@ -1,13 +1,13 @@
 from abc import ABC, abstractmethod
 from util import FES
 
-EVENT_Q = FES()
-
+# Events are put on the event queue of the simulation that creates them
 class Event(ABC):
-    def __init__(self, time=None, donor=None):
+    def __init__(self, time=None, donor=None, event_q=None):
         self.time = time
         self.donor = donor
-        EVENT_Q.enqueue(self)
+        if event_q is not None:
+            event_q.enqueue(self)
 
     @abstractmethod
     def handle(self, sim):
@@ -32,7 +32,7 @@ class CheckinEvent(Event):
     def handle(self, sim):
         # set questionaire done time and event
         done_time = self.time + Simulation.dist_questionnaire.rvs()
-        event = QuestionaireEvent(done_time, self.donor)
+        event = QuestionaireEvent(done_time, self.donor, sim.event_q)
         # register waiting time
         sim.queues.registration_queue_res.registerWaitingTime(self.time - self.donor.waiting_time)
 
@@ -49,7 +49,7 @@ class InterviewStartEvent(Event):
     def handle(self, sim):
         # set end interview time and event
         done_time = self.time + Simulation.dist_interview.rvs()
-        event = InterviewStopEvent(done_time, self.donor)
+        event = InterviewStopEvent(done_time, self.donor, sim.event_q)
         # register waiting time
         wTime = self.time - self.donor.waiting_time
         if (self.donor.donor_type == Donor.WHOLE_BLOOD):
@@ -74,7 +74,7 @@ class StartConnectEvent(Event):
     def handle(self, sim):
         # set connect end time and event
         done_time = self.time + Simulation.dist_connect.rvs()
-        event = EndConnectEvent(done_time, self.donor)
+        event = EndConnectEvent(done_time, self.donor, sim.event_q)
         # register waiting time
         wTime = self.time - self.donor.waiting_time
         if (self.donor.donor_type == Donor.WHOLE_BLOOD):
@@ -94,7 +94,7 @@ class EndConnectEvent(Event):
             done_time = self.time + Simulation.dist_whole_blood.rvs()
         elif (self.donor.donor_type == Donor.PLASMA):
             done_time = self.time + Simulation.dist_plasma.rvs()
-        event = DisconnectReadyEvent(done_time, self.donor)
+        event = DisconnectReadyEvent(done_time, self.donor, sim.event_q)
         # free nurse
         sim.free_nurse() 
 
@@ -111,7 +111,7 @@ class StartDisconnectEvent(Event):
     def handle(self, sim):
         # set disconnect end time and event
         done_time = self.time + Simulation.dist_disconnect.rvs()
-        event = EndDisconnectEvent(done_time, self.donor)
+        event = EndDisconnectEvent(done_time, self.donor, sim.event_q)
         # register waiting time
         sim.queues.disconnect_queue_res.registerWaitingTime(wTime)
         # occupy nurse
@@ -122,7 +122,7 @@ class EndDisconnectEvent(Event):
     def handle(self, sim):
         # set leave time and event
         done_time = self.time + Simulation.dist_recover.rvs()
-        event = LeaveEvent(done_time, self.donor)
+        event = LeaveEvent(done_time, self.donor, sim.event_q)
         # free nurse
         sim.free_nurse()
 
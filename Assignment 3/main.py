@@ -146,6 +146,7 @@ class Simulation:
 
     def __init__(self, interviewers=2, nurses=4, beds_blood=7, beds_plasma=7):
         self.handled_events = []
+        self.event_q = FES()
         self.opening_time = 8 * 60
         self.closing_time = 20 * 60
         self.queues = Queues()
@@ -160,12 +161,12 @@ class Simulation:
             self.simulate_day()
 
     def simulate_day(self):
-        EVENT_Q.clear()
+        self.event_q.clear()
         self.time = self.opening_time
         self.generate_arrivals()
 
         while self.time < self.closing_time:
-            next_event = EVENT_Q.pop()
+            next_event = self.event_q.pop()
             self.time = next_event
             next_event.handle(self)
             self.handled_events.append(next_event)
@@ -182,14 +183,14 @@ class Simulation:
     def generate_plasma_arrrivals(self):
         for t in range(self.opening_time, self.closing_time - 60, 6):
             donor = Donor(t, Donor.PLASMA)
-            arrival = ArrivalEvent(t, donor)
+            arrival = ArrivalEvent(t, donor, self.event_q)
 
     def generate_whole_blood_arrivals(self):
         generator = NNHP(arrival_rate, max_rate)
         arrivals = generator.arrivals(0, self.closing_time - self.opening_time)
         for arrival_time in arrivals:
             arriving_donor = Donor(arrival_time, Donor.WHOLE_BLOOD)
-            arrival_event = ArrivalEvent(arrival_time, arriving_donor)
+            arrival_event = ArrivalEvent(arrival_time, arriving_donor, self.event_q)
 
     def occupy_interviewer(self):
         if self.available_interviewers > 0:
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from scipy import stats
+from event_handlers import *
+from observers import *
+from replication import *
+
+# Performance indicators of a simulated site-day
+WAITING_KPIS = ['whole blood st', 'plasma st', 'bed wait']
+COUNT_KPIS = ['donors', 'served', 'whole blood departures', 'plasma departures']
+UTILIZATION_KPIS = ['whole blood bed utilization', 'plasma bed utilization', *[f'{job.lower()} utilization' for job in JOBS]]
+KPIS = [*COUNT_KPIS, *WAITING_KPIS, *UTILIZATION_KPIS, 'closing time']
+
+# The count by which a waiting KPI of the sites is weighted in the region, the number of donors that the KPI is a mean of
+KPI_WEIGHTS = {'whole blood st': 'whole blood departures', 'plasma st': 'plasma departures', 'bed wait': 'served'}
+
+# Simulates a day of a site and returns its KPIs (see day_kpis). This is the task of the worker processes.
+def simulate_site_day(task):
+    name, day, config, seed = task
+    kpis = day_kpis((config, seed))
+    return name, day, [kpis[kpi] for kpi in KPIS]
+
+'''
+A NetworkRunner simulates a regional network of blood collection sites, every site with its own configuration (staff,
+beds, arrival rates, ...). Every site-day is an independent system with its own SeedSequence, spawned per site and then
+per day, so the results do not depend on the number of workers or the order of the sites.
+
+The site-days are sharded over the worker processes in chunks, and only their KPIs are sent back. run() returns a table
+with a row per site-day, from which site() and region() compute the site-level and region-level KPIs.
+'''
+class NetworkRunner:
+    def __init__(self, site_configs, seed=3, workers=None, chunksize=8):
+        self.site_configs = dict(site_configs)
+        self.seed_sequences = dict(zip(self.site_configs, np.random.SeedSequence(seed).spawn(len(self.site_configs))))
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunksize = chunksize
+        self.days = 0
+        self.rows = []
+
+    # Simulates the next days of every site, and returns the KPIs of all simulated site-days
+    def run(self, days):
+        tasks = [(name, self.days + day, {'name': name, **config}, seed)
+                 for name, config in self.site_configs.items()
+                 for day, seed in enumerate(self.seed_sequences[name].spawn(days))]
+        self.days += days
+
+        if self.workers == 1:
+            results = map(simulate_site_day, tasks)
+            self.rows += [(name, day, *kpis) for name, day, kpis in results]
+        else:
+            with Pool(self.workers) as pool:
+                results = pool.imap_unordered(simulate_site_day, tasks, self.chunksize)
+                self.rows += [(name, day, *kpis) for name, day, kpis in results]
+
+        return self.site_days()
+
+    def site_days(self):
+        return pd.DataFrame(self.rows, columns=['site', 'day', *KPIS]).sort_values(['site', 'day'], ignore_index=True)
+
+    # Mean KPIs and the half widths of their confidence intervals, per site
+    def site(self, confidence=0.95):
+        site_days = self.site_days()
+        grouped = site_days.groupby('site')[KPIS]
+        means = grouped.mean()
+        half_widths = grouped.sem() * stats.t.ppf((1 + confidence) / 2, grouped.count() - 1)
+        return means.join(half_widths, rsuffix=' ci')
+
+    # KPIs of the region per day: the total counts, the means of the sojourn times and bed wait weighted by the donors
+    # they are a mean of (see KPI_WEIGHTS) over the sites where they are known, the mean utilizations of the sites and
+    # the latest closing time
+    def region_days(self):
+        site_days = self.site_days()
+        grouped = site_days.groupby('day')
+        region = grouped[COUNT_KPIS].sum()
+        for kpi, count in KPI_WEIGHTS.items():
+            weights = site_days[count].where(site_days[kpi].notna(), 0)
+            weighted = (site_days[kpi].fillna(0) * weights).groupby(site_days['day']).sum()
+            region[kpi] = weighted / weights.groupby(site_days['day']).sum()
+        region[UTILIZATION_KPIS] = grouped[UTILIZATION_KPIS].mean()
+        region['closing time'] = grouped['closing time'].max()
+        return region[KPIS]
+
+    # Mean KPIs of the region per day, with the standard error over the days
+    def region(self):
+        region_days = self.region_days()
+        return pd.DataFrame({'mean': region_days.mean(), 'sem': region_days.sem()})
+
+if __name__ == '__main__':
+    import time
+    rng = np.random.default_rng(1)
+    configs = { }
+    for i in range(20):
+        configs[f'Site {i+1}'] = {
+            'doctors': int(rng.integers(2, 5)),
+            'nurses': int(rng.integers(1, 3)),
+            'beds_plasma': int(rng.integers(6, 12)),
+            'arrival_rates': ARRIVAL_RATES * rng.uniform(0.6, 1.2)}
+
+    runner = NetworkRunner(configs)
+    start = time.time()
+    runner.run(10)
+    print(f'{len(runner.rows)} site-days in {time.time() - start:.1f} seconds')
+    print(runner.site())
+    print(runner.region())
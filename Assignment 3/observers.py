@@ -0,0 +1,249 @@
+import numpy as np
+from array import array
+from system import *
+
+'''
+A StepSeries is a piecewise constant function of time, stored as its change points (time, value).
+The area under the function is updated with every change, so the time weighted mean is available at any moment.
+'''
+class StepSeries:
+    def __init__(self, start_time, value=0):
+        self.start_time = start_time
+        self.last_time = start_time
+        self.value = value
+        self.area = 0.0
+        self.points = [(start_time, value)]
+
+    def update(self, time, value):
+        self.area += self.value * (time - self.last_time)
+        self.last_time = time
+        self.value = value
+        self.points.append((time, value))
+
+    def mean(self, end_time=None):
+        end_time = self.last_time if end_time is None else end_time
+        if end_time <= self.start_time:
+            return self.value
+        area = self.area + self.value * (end_time - self.last_time)
+        return area / (end_time - self.start_time)
+
+# Returns the donor action of an action, which can be part of a combined action
+def donor_action_of(action):
+    if type(action) is CombinedAction:
+        return action.donor_action
+    return action if type(action) is DonorAction else None
+
+# Returns the staff action of an action, which can be part of a combined action
+def staff_action_of(action):
+    if type(action) is CombinedAction:
+        return action.staff_action
+    return action if type(action) is StaffAction else None
+
+'''
+A CountObserver keeps a counter per key. Subclasses determine which counters an action changes.
+A new point is added to the series of a counter once per event, with the value after all actions of the event.
+'''
+class CountObserver(Observer):
+    def __init__(self, keys, start_time):
+        self.start_time = start_time
+        self.counts = {key: 0 for key in keys}
+        self.series = {key: StepSeries(start_time) for key in keys}
+        self.changed = { }
+
+    # Should return a list of (key, change) tuples
+    def changes(self, action):
+        return []
+
+    def on_action(self, time, action):
+        for key, change in self.changes(action):
+            if key not in self.counts:
+                self.counts[key] = 0
+                self.series[key] = StepSeries(self.start_time)
+            self.counts[key] += change
+            self.changed[key] = None
+
+    def on_event(self, event):
+        for key in self.changed:
+            self.series[key].update(event.time, self.counts[key])
+        self.changed = { }
+
+    # Lists of (time, value) tuples per key
+    @property
+    def data(self):
+        return {key: series.points for key, series in self.series.items()}
+
+    # Time weighted means per key
+    def means(self, end_time=None):
+        return {key: series.mean(end_time) for key, series in self.series.items()}
+
+# Number of donors in each queue
+class QueueLengthObserver(CountObserver):
+    def changes(self, action):
+        action = donor_action_of(action)
+        if action is None or type(action.component) is not Q:
+            return []
+        return [(action.component, 1 if action.type == DonorAction.ENTER else -1)]
+
+# Number of donors in each section, and in all sections together
+class SectionObserver(CountObserver):
+    TOTAL = 'Total'
+
+    def __init__(self, sections, start_time):
+        super().__init__(list(sections) + [SectionObserver.TOTAL], start_time)
+
+    def changes(self, action):
+        action = donor_action_of(action)
+        if action is None or type(action.component) is not Section:
+            return []
+        change = 1 if action.type == DonorAction.ENTER else -1
+        return [(action.component, change), (SectionObserver.TOTAL, change)]
+
+# Number of occupied staff members per job
+class StaffOccupationObserver(CountObserver):
+    def changes(self, action):
+        action = staff_action_of(action)
+        if action is None:
+            return []
+        return [(action.staff_member.job, 1 if action.type == StaffAction.OCCUPY else -1)]
+
+# Number of occupied beds per donor type. A donor occupies a bed while being in the donation room
+class BedOccupationObserver(CountObserver):
+    BED_TYPES = {Donor.WHOLE_BLOOD: 'Whole blood', Donor.PLASMA: 'Plasma'}
+
+    def __init__(self, donation_room, start_time):
+        super().__init__(BedOccupationObserver.BED_TYPES.values(), start_time)
+        self.donation_room = donation_room
+
+    def changes(self, action):
+        action = donor_action_of(action)
+        if action is None or action.component is not self.donation_room:
+            return []
+        return [(BedOccupationObserver.BED_TYPES[action.donor.type], 1 if action.type == DonorAction.ENTER else -1)]
+
+# Sojourn times of the donors leaving the system, per donor type
+class SojournTimeObserver(Observer):
+    def __init__(self):
+        self.sojourn_times = {Donor.WHOLE_BLOOD: [], Donor.PLASMA: []}
+
+    def on_action(self, time, action):
+        action = donor_action_of(action)
+        if action is None or action.type != DonorAction.LEAVE or type(action.component) is not System:
+            return
+        self.sojourn_times[action.donor.type].append(time - action.donor.arrival_time)
+
+    # Tuple of the whole blood and plasma sojourn times
+    @property
+    def data(self):
+        return self.sojourn_times[Donor.WHOLE_BLOOD], self.sojourn_times[Donor.PLASMA]
+
+# Time that every donor spent in a component, per donor type
+class WaitTimeObserver(Observer):
+    def __init__(self, component):
+        self.component = component
+        self.entered = { }
+        self.wait_times = {Donor.WHOLE_BLOOD: [], Donor.PLASMA: []}
+
+    def on_action(self, time, action):
+        action = donor_action_of(action)
+        if action is None or action.component is not self.component:
+            return
+        if action.type == DonorAction.ENTER:
+            self.entered[action.donor] = time
+        else:
+            self.wait_times[action.donor.type].append(time - self.entered.pop(action.donor))
+
+    # Tuple of the whole blood and plasma wait times
+    @property
+    def data(self):
+        return self.wait_times[Donor.WHOLE_BLOOD], self.wait_times[Donor.PLASMA]
+
+'''
+An EventLog records every executed action as a row of typed columns, instead of keeping the events and their actions:
+the time, the number of the event, the kind of action and the ids of the component, donor and staff member (-1 if the
+action has none). A combined action gives a row for its donor action and a row for its staff action.
+The class and name of the components, the job and name of the staff members (by rank) and the types of the donors are
+kept by id, so the components and staff can be recreated from the log (see replay.py).
+'''
+class EventLog(Observer):
+    ENTER = 0
+    LEAVE = 1
+    OCCUPY = 2
+    FREE = 3
+    KINDS = ['enter', 'leave', 'occupy', 'free']
+
+    # typecodes of the columns, which are also numpy dtypes
+    COLUMNS = {'time': 'd', 'event': 'i', 'kind': 'b', 'component': 'i', 'donor': 'i', 'staff': 'h'}
+
+    def __init__(self):
+        self.data = {name: array(typecode) for name, typecode in EventLog.COLUMNS.items()}
+        self.n_events = 0
+        self.components = { }
+        self.staff = { }
+        self.donor_types = { }
+
+    def append(self, time, kind, component, donor, staff):
+        data = self.data
+        data['time'].append(time)
+        data['event'].append(self.n_events)
+        data['kind'].append(kind)
+        data['component'].append(component)
+        data['donor'].append(donor)
+        data['staff'].append(staff)
+
+    def on_action(self, time, action):
+        if type(action) is CombinedAction:
+            self.on_action(time, action.donor_action)
+            self.on_action(time, action.staff_action)
+        elif type(action) is DonorAction:
+            component, donor = action.component, action.donor
+            if component.id not in self.components:
+                self.components[component.id] = (type(component).__name__, component.name)
+            if donor.id not in self.donor_types:
+                self.donor_types[donor.id] = donor.type
+            kind = EventLog.ENTER if action.type == DonorAction.ENTER else EventLog.LEAVE
+            self.append(time, kind, component.id, donor.id, -1)
+        elif type(action) is StaffAction:
+            member = action.staff_member
+            if member.rank not in self.staff:
+                self.staff[member.rank] = (member.job, member.name)
+            kind = EventLog.OCCUPY if action.type == StaffAction.OCCUPY else EventLog.FREE
+            self.append(time, kind, -1, -1, member.rank)
+
+    def on_event(self, event):
+        self.n_events += 1
+
+    # The columns as numpy arrays, which share the memory of the log
+    def columns(self):
+        return {name: np.frombuffer(column, dtype=column.typecode) for name, column in self.data.items()}
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.data.values())
+
+    def __len__(self):
+        return len(self.data['time'])
+
+# The jobs of the staff of a blood collection site
+JOBS = ['Receptionist', 'Doctor', 'Nurse']
+
+# Creates the observers of the metrics of a blood collection site
+def create_observers(site):
+    return {
+        'section_donors': SectionObserver(
+            [site.registration_line, site.question_room, site.pre_interview_room, site.pre_donation_room, site.donation_room],
+            site.opening_time),
+        'queue_lengths': QueueLengthObserver(
+            [site.registration_q, site.interview_q, site.donation_q, site.connect_q, site.disconnect_q], site.opening_time),
+        'bed_occupation': BedOccupationObserver(site.donation_room, site.opening_time),
+        'staff_occupation': StaffOccupationObserver(JOBS, site.opening_time),
+        'sojourn_times': SojournTimeObserver()
+    }
+
+# Creates the observers of the key performance indicators of a site-day (see replication.day_kpis)
+def create_kpi_observers(site):
+    return {
+        'sojourn_times': SojournTimeObserver(),
+        'bed_waits': WaitTimeObserver(site.donation_q),
+        'donations': WaitTimeObserver(site.donation_room),
+        'staff_occupation': StaffOccupationObserver(JOBS, site.opening_time)
+    }
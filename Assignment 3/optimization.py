@@ -0,0 +1,111 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from multiprocessing import Pool
+from replication import day_kpis
+
+'''
+Base class of the optimizers of the blood bank, which compare candidates with successive halving: all candidates are
+simulated for a few days, the best 1/eta of them survive and are simulated eta times as many days (at most max_days),
+until one candidate remains.
+Day i of every candidate uses the same SeedSequence (common random numbers), so differences between candidates are
+caused by the candidates rather than by noise, and the days of earlier rounds are reused. Days are simulated in a
+pool of worker processes, and the metrics of a day are key performance indicators of day_kpis (see replication.py).
+A candidate with a NaN metric on one of its days (for example a day without plasma donors) cannot be judged, and is
+ranked last.
+
+Subclasses define the candidates and:
+- metrics: the names of the key performance indicators that are scored
+- config(candidate): the site configuration of a candidate
+- score(metrics): the score of the metrics (means over the days), lower is better
+- describe(candidate): extra columns of the history, for example the cost of a candidate
+'''
+class SuccessiveHalving(ABC):
+    metrics = []
+    candidate_name = 'candidate'
+    score_name = 'score'
+
+    def __init__(self, candidates, eta=2, initial_days=2, max_days=64, seed=3, workers=None):
+        self.candidates = [tuple(candidate) for candidate in candidates]
+        self.eta = eta
+        self.initial_days = initial_days
+        self.max_days = max_days
+        self.workers = os.cpu_count() if workers is None else workers
+
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.day_seeds = []
+        # metrics of every simulated day, per candidate
+        self.results = { }
+
+    @abstractmethod
+    def config(self, candidate):
+        pass
+
+    @abstractmethod
+    def score(self, metrics):
+        pass
+
+    def describe(self, candidate):
+        return { }
+
+    def seeds(self, days):
+        if days > len(self.day_seeds):
+            self.day_seeds += self.seed_sequence.spawn(days - len(self.day_seeds))
+        return self.day_seeds[:days]
+
+    # Mean metrics of the first days of a candidate
+    def day_metrics(self, candidate, days=None):
+        return np.mean(self.results[candidate][:days], axis=0)
+
+    # Simulates the days that are not simulated yet, and returns the score of every candidate
+    def evaluate(self, candidates, days, pool=None):
+        seeds = self.seeds(days)
+        jobs = [(candidate, day) for candidate in candidates for day in range(len(self.results.get(candidate, [])), days)]
+        tasks = [(self.config(candidate), seeds[day]) for candidate, day in jobs]
+
+        results = pool.map(day_kpis, tasks) if pool is not None else map(day_kpis, tasks)
+        for (candidate, _), kpis in zip(jobs, results):
+            self.results.setdefault(candidate, []).append([kpis[metric] for metric in self.metrics])
+
+        return np.array([self.candidate_score(candidate, days) for candidate in candidates])
+
+    def candidate_score(self, candidate, days):
+        metrics = self.day_metrics(candidate, days)
+        return math.inf if np.isnan(metrics).any() else self.score(metrics)
+
+    def optimize(self):
+        if self.workers == 1:
+            return self.halve(None)
+        with Pool(self.workers) as pool:
+            return self.halve(pool)
+
+    def halve(self, pool):
+        survivors = list(self.candidates)
+        days = self.initial_days
+        history = []
+
+        round_nr = 0
+
+        while len(survivors) > 1:
+            round_nr += 1
+            print(f'Round {round_nr}: {len(survivors)} candidates, {days} days')
+            scores = self.evaluate(survivors, days, pool)
+            for candidate, score in zip(survivors, scores):
+                history.append({
+                    'round': round_nr,
+                    'days': days,
+                    self.candidate_name: candidate,
+                    **self.describe(candidate),
+                    **dict(zip(self.metrics, self.day_metrics(candidate, days))),
+                    self.score_name: score})
+
+            # only the best 1/eta of the candidates get more days
+            ranking = np.argsort(scores, kind='stable')
+            survivors = [survivors[i] for i in ranking[:math.ceil(len(survivors) / self.eta)]]
+            days = min(days * self.eta, self.max_days)
+
+        self.best = survivors[0]
+        self.history = pd.DataFrame(history)
+        return self.config(self.best), self.history
@@ -0,0 +1,139 @@
+import json
+import os
+import numpy as np
+from types import SimpleNamespace
+from observers import *
+
+COMPONENT_CLASSES = {'Q': Q, 'Section': Section, 'System': System}
+
+'''
+Saves an EventLog to a directory: every column as a .npy file, the donor types as two .npy files (ids and types),
+and the names of the components and staff in metadata.json.
+If the site is given, its components, staff lists, opening and closing time and configuration are saved as well, so
+the observers of the site (create_observers) can be recreated for a replay.
+'''
+def save_log(log, directory, site=None):
+    os.makedirs(directory, exist_ok=True)
+    for name, column in log.columns().items():
+        np.save(os.path.join(directory, f'{name}.npy'), column)
+
+    donor_ids = np.fromiter(log.donor_types.keys(), np.int32, len(log.donor_types))
+    donor_types = np.fromiter(log.donor_types.values(), np.int8, len(log.donor_types))
+    np.save(os.path.join(directory, 'donor_ids.npy'), donor_ids)
+    np.save(os.path.join(directory, 'donor_types.npy'), donor_types)
+
+    metadata = {
+        'n_rows': len(log),
+        'n_events': log.n_events,
+        'columns': EventLog.COLUMNS,
+        'components': log.components,
+        'staff': log.staff,
+        'site': None if site is None else site_metadata(site)
+    }
+    with open(os.path.join(directory, 'metadata.json'), 'w') as file:
+        json.dump(metadata, file)
+
+# The components (id, class and name) and staff lists (ranks) of a site, and its times and configuration
+def site_metadata(site):
+    components = { }
+    staff = { }
+    for name, value in vars(site).items():
+        if isinstance(value, Component):
+            components[name] = (value.id, type(value).__name__, value.name)
+        elif isinstance(value, list) and value and all(isinstance(member, StaffMember) for member in value):
+            staff[name] = [member.rank for member in value]
+
+    return {
+        'components': components,
+        'staff': staff,
+        'opening_time': site.opening_time,
+        'closing_time': site.closing_time,
+        'config': site.config
+    }
+
+'''
+A LogReplay reads a log that is saved by save_log, and feeds its actions to observers as if the system was simulated.
+The columns are memory mapped and read in chunks, so logs that are larger than the memory can be replayed.
+
+The components and staff members are recreated from the metadata (with the ids and ranks of the log), and site is
+a namespace with the same attributes as the saved site, so create_observers(replay.site) gives the usual metrics.
+'''
+class LogReplay:
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'metadata.json')) as file:
+            self.metadata = json.load(file)
+
+        self.columns = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                        for name in self.metadata['columns']}
+        donor_ids = np.load(os.path.join(directory, 'donor_ids.npy'))
+        donor_types = np.load(os.path.join(directory, 'donor_types.npy'))
+        self.donor_types = dict(zip(donor_ids.tolist(), donor_types.tolist()))
+
+        self.components = { }
+        for id, (cls, name) in self.metadata['components'].items():
+            component = COMPONENT_CLASSES[cls](name)
+            component.id = int(id)
+            self.components[component.id] = component
+
+        self.staff = { }
+        for rank, (job, name) in self.metadata['staff'].items():
+            member = StaffMember(job, name)
+            member.rank = int(rank)
+            self.staff[member.rank] = member
+
+        self.site = None if self.metadata['site'] is None else self.create_site(self.metadata['site'])
+
+    def create_site(self, metadata):
+        site = SimpleNamespace(
+            opening_time=metadata['opening_time'],
+            closing_time=metadata['closing_time'],
+            config=metadata['config'])
+        for name, (id, cls, component_name) in metadata['components'].items():
+            # components without any actions are not in the log
+            if id not in self.components:
+                self.components[id] = COMPONENT_CLASSES[cls](component_name)
+                self.components[id].id = id
+            setattr(site, name, self.components[id])
+        for name, ranks in metadata['staff'].items():
+            setattr(site, name, [self.staff[rank] for rank in ranks if rank in self.staff])
+        return site
+
+    def __len__(self):
+        return self.metadata['n_rows']
+
+    def replay(self, observers, chunk_size=1 << 16):
+        observers = list(observers)
+        donors = { }
+        event_nr = None
+        event_time = None
+
+        for start in range(0, len(self), chunk_size):
+            chunk = [self.columns[name][start:start + chunk_size].tolist() for name in EventLog.COLUMNS]
+
+            for time, event, kind, component, donor, staff in zip(*chunk):
+                if event != event_nr:
+                    if event_nr is not None:
+                        for observer in observers:
+                            observer.on_event(Event(event_time, None))
+                    event_nr, event_time = event, time
+
+                if kind == EventLog.OCCUPY or kind == EventLog.FREE:
+                    action_type = StaffAction.OCCUPY if kind == EventLog.OCCUPY else StaffAction.FREE
+                    action = StaffAction(self.staff[staff], action_type)
+                else:
+                    if donor not in donors:
+                        donors[donor] = Donor(time, self.donor_types[donor])
+                        donors[donor].id = donor
+                    component = self.components[component]
+                    action_type = DonorAction.ENTER if kind == EventLog.ENTER else DonorAction.LEAVE
+                    action = DonorAction(component, donors[donor], action_type)
+                    # a donor that leaves the system does not return
+                    if action_type == DonorAction.LEAVE and type(component) is System:
+                        del donors[donor]
+
+                for observer in observers:
+                    observer.on_action(time, action)
+
+        if event_nr is not None:
+            for observer in observers:
+                observer.on_event(Event(event_time, None))
@@ -0,0 +1,216 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+from event_handlers import *
+from observers import *
+from resampling import *
+from aggregation import *
+
+# The results are resampled per minute, from opening time until all donors have left
+MINUTES = np.arange(480, 1500)
+
+# The metrics that are step series, these are aggregated per minute over all days
+STEP_METRICS = ['section_donors', 'queue_lengths', 'bed_occupation', 'staff_occupation']
+
+# Key performance indicators of a site-day, see day_kpis
+DAY_KPIS = ['donors', 'served', 'whole blood departures', 'plasma departures', 'whole blood st', 'plasma st', 'bed wait',
+            'whole blood bed utilization', 'plasma bed utilization', *[f'{job.lower()} utilization' for job in JOBS],
+            'closing time']
+
+# The number of staff members per job of a site configuration
+def staff_counts(config=None):
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    return {'Receptionist': config['receptionists'], 'Doctor': config['doctors'], 'Nurse': config['nurses']}
+
+# The mean of the values, or NaN if there are none (for example the sojourn times of a day without plasma donors)
+def mean_or_nan(values):
+    return np.mean(values) if len(values) else np.nan
+
+# Time weighted mean of every minute, for each series of a day. The keys are replaced by their names,
+# so the result does not refer to the system anymore and can be sent between processes.
+def fill_minutes(data):
+    keys, values = resample_series(data, MINUTES[0], MINUTES[-1] + 1, how=MEAN)
+    return {str(key): row.astype(np.float32) for key, row in zip(keys, values)}
+
+# A compact summary of a simulated day: per-minute metrics, the mean sojourn times, bed utilization and some counts
+def summarize_day(site, simulator, observers):
+    st_blood, st_plasma = observers['sojourn_times'].data
+    return {
+        'closing_time': simulator.time,
+        'n_donors': site.n_donors,
+        'n_events': simulator.n_events,
+        'n_actions': simulator.n_actions,
+        'donors_in_system': len(site.system.donors),
+        'staff_counts': staff_counts(site.config),
+        'metrics': {metric: fill_minutes(observers[metric].data) for metric in STEP_METRICS},
+        'sojourn_times': (mean_or_nan(st_blood), mean_or_nan(st_plasma)),
+        'bed_utilization': {BedOccupationObserver.BED_TYPES[bed_type]: utilization
+                            for bed_type, utilization in site.beds.utilization(simulator.time).items()}
+    }
+
+# Simulates a day on a new site, with the observers that are created by create(site)
+def run_day(config, seed, create=create_observers):
+    site = create_site(config, seed)
+    site.add_arrivals()
+
+    observers = create(site)
+    simulator = Simulator(site.system, observers=observers.values(), keep_events=False)
+    simulator.simulate()
+    return site, simulator, observers
+
+# Simulates a single day and returns its summary. This is the task of the worker processes of a ReplicationRunner.
+def simulate_day(task):
+    config, seed = task
+    return summarize_day(*run_day(config, seed))
+
+'''
+Simulates a single day and returns its key performance indicators (DAY_KPIS) as a dict: the arrived and served donors,
+the departed donors and mean sojourn time per donor type, the mean time a served donor waited for a bed, the bed and
+staff utilizations and the closing time.
+A mean over no donors, such as the plasma sojourn time of a day without plasma donors, is NaN.
+This is the task of the worker processes of the optimizers and the NetworkRunner.
+'''
+def day_kpis(task):
+    config, seed = task
+    site, simulator, observers = run_day(config, seed, create_kpi_observers)
+
+    st_blood, st_plasma = observers['sojourn_times'].data
+    served = sum(len(times) for times in observers['donations'].data)
+    bed_wait = sum(sum(times) for times in observers['bed_waits'].data)
+    bed_utilization = site.beds.utilization(simulator.time)
+    counts = staff_counts(site.config)
+    occupation = observers['staff_occupation'].means(simulator.time)
+
+    kpis = {
+        'donors': site.n_donors,
+        'served': served,
+        'whole blood departures': len(st_blood),
+        'plasma departures': len(st_plasma),
+        'whole blood st': mean_or_nan(st_blood),
+        'plasma st': mean_or_nan(st_plasma),
+        'bed wait': bed_wait / served if served else np.nan,
+        'whole blood bed utilization': bed_utilization[Donor.WHOLE_BLOOD],
+        'plasma bed utilization': bed_utilization[Donor.PLASMA],
+        'closing time': simulator.time
+    }
+    for job in JOBS:
+        kpis[f'{job.lower()} utilization'] = occupation[job] / counts[job] if counts[job] else np.nan
+    return kpis
+
+def create_aggregates():
+    aggregates = {metric: DayAggregate(MINUTES) for metric in STEP_METRICS}
+    # the mean sojourn time of every day, for whole blood and plasma donors
+    aggregates['sojourn_times'] = ([], [])
+    return aggregates
+
+# Adds the summary of a day to the aggregates, as soon as the day has been simulated
+def aggregate_day(aggregates, summary):
+    for metric in STEP_METRICS:
+        aggregates[metric].add_day(summary['metrics'][metric])
+
+    for daily_means, mean in zip(aggregates['sojourn_times'], summary['sojourn_times']):
+        daily_means.append(mean)
+
+'''
+A ReplicationRunner simulates independent days of a site configuration in a pool of worker processes.
+Every day gets its own SeedSequence, spawned from the seed of the runner, so the days are independent and a run
+is reproducible regardless of the number of workers. Summaries are yielded in order, as soon as they are available.
+
+The pool is started on the first run, and is stopped by close() (or by using the runner in a with statement).
+'''
+class ReplicationRunner:
+    def __init__(self, config=None, seed=None, workers=None, chunksize=4):
+        self.config = config
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunksize = chunksize
+        self.pool = None
+
+    def run(self, days):
+        # spawning again on a next run gives new, independent seeds
+        tasks = [(self.config, seed) for seed in self.seed_sequence.spawn(days)]
+
+        if self.workers == 1:
+            yield from map(simulate_day, tasks)
+            return
+
+        if self.pool is None:
+            self.pool = Pool(self.workers)
+        yield from self.pool.imap(simulate_day, tasks, self.chunksize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+'''
+A SequentialReplication simulates days in parallel batches until the confidence intervals of the daily means are
+precise enough: the half width relative to the mean should be at most the precision of its group, for the sojourn times
+(whole blood and plasma), the number of donors per section and the occupation per job. The precision is a single value
+for all groups, or a value per group.
+At least min_days and at most max_days days are simulated, and days tells how many days were used.
+'''
+class SequentialReplication:
+    GROUPS = ['sojourn_times', 'section_donors', 'staff_occupation']
+
+    def __init__(self, precision=0.05, confidence=0.95, config=None, seed=3, workers=None, batch_size=None,
+                 min_days=10, max_days=1000):
+        self.precision = precision if isinstance(precision, dict) else {group: precision for group in self.GROUPS}
+        self.confidence = confidence
+        self.runner = ReplicationRunner(config, seed, workers)
+        self.batch_size = batch_size or max(4, 2 * self.runner.workers)
+        self.min_days = min_days
+        self.max_days = max_days
+
+        self.aggregates = create_aggregates()
+        # daily means per (group, key)
+        self.daily_means = { }
+        self.days = 0
+
+    def add_day(self, summary):
+        aggregate_day(self.aggregates, summary)
+        self.days += 1
+
+        daily_means = [(('sojourn_times', BedOccupationObserver.BED_TYPES[donor_type]), mean)
+                       for donor_type, mean in zip([Donor.WHOLE_BLOOD, Donor.PLASMA], summary['sojourn_times'])]
+        for group in ['section_donors', 'staff_occupation']:
+            daily_means += [((group, key), values.mean()) for key, values in summary['metrics'][group].items()]
+
+        for target, mean in daily_means:
+            self.daily_means.setdefault(target, []).append(float(mean))
+
+    # Relative precision of every (group, key). Days without a mean (NaN, for example the plasma sojourn time of a day
+    # without plasma donors) are left out, and a (group, key) without any mean has nothing to estimate.
+    def precisions(self):
+        precisions = { }
+        for target, means in self.daily_means.items():
+            means = [mean for mean in means if not np.isnan(mean)]
+            if means:
+                precisions[target] = relative_precision(means, self.confidence)
+        return precisions
+
+    def converged(self):
+        if self.days < self.min_days:
+            return False
+        return all(precision <= self.precision[group] for (group, _), precision in self.precisions().items()
+                   if group in self.precision)
+
+    # Simulates batches until the precision is met, callback (if given) is called with the summary of every day
+    def run(self, callback=None):
+        try:
+            while self.days < self.max_days and not self.converged():
+                for summary in self.runner.run(min(self.batch_size, self.max_days - self.days)):
+                    self.add_day(summary)
+                    if callback is not None:
+                        callback(summary)
+        finally:
+            self.runner.close()
+
+        return self.aggregates
@@ -0,0 +1,58 @@
+import numpy as np
+
+'''
+Resampling of step series: change points (time, value), where each value holds until the next change point.
+All functions are vectorized with np.searchsorted, so resampling costs O(points + intervals * log(points)).
+
+Two semantics are supported for the value of an interval [t, t + step):
+LAST: the value at the end of the interval (the last change before t + step)
+MEAN: the time weighted mean of the values during the interval
+Before the first change point, the series has its first value.
+'''
+LAST = 'last'
+MEAN = 'mean'
+
+# Converts a list of (time, value) tuples to a times and a values array
+def to_arrays(points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[:, 0], points[:, 1]
+
+# Area under the step series from its first change point until each of the given times.
+# values can be 1D, or 2D with one series per row that all have the same change times.
+def cumulative_area(times, values, at):
+    areas = np.zeros(values.shape)
+    areas[..., 1:] = np.cumsum(values[..., :-1] * np.diff(times), axis=-1)
+    index = np.clip(np.searchsorted(times, at, side='right') - 1, 0, None)
+    return areas[..., index] + values[..., index] * (at - times[index])
+
+# Resamples step series to intervals of length step, starting at start and ending before end.
+# Returns an array with the value of every interval, with a row per series if values is 2D.
+def resample(times, values, start, end, step=1, how=MEAN):
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    bounds = start + step * np.arange(int(np.ceil((end - start) / step)) + 1, dtype=np.float64)
+
+    if how == LAST:
+        index = np.clip(np.searchsorted(times, bounds[1:], side='left') - 1, 0, None)
+        return values[..., index]
+    if how == MEAN:
+        return np.diff(cumulative_area(times, values, bounds), axis=-1) / np.diff(bounds)
+    raise ValueError(f'Unknown resampling method: {how}')
+
+# Combines step series with different change times into a single times array and a 2D values array,
+# in which every series has its value at each of the combined change times.
+def align(series):
+    arrays = [to_arrays(points) for points in series]
+    times = np.unique(np.concatenate([series_times for series_times, _ in arrays]))
+    values = np.empty((len(arrays), len(times)))
+    for row, (series_times, series_values) in enumerate(arrays):
+        index = np.clip(np.searchsorted(series_times, times, side='right') - 1, 0, None)
+        values[row] = series_values[index]
+    return times, values
+
+# Resamples a dictionary of step series (key -> list of (time, value) tuples) at once.
+# Returns the keys and an array with a row per key.
+def resample_series(data, start, end, step=1, how=MEAN):
+    keys = list(data.keys())
+    times, values = align([data[key] for key in keys])
+    return keys, resample(times, values, start, end, step, how)
@@ -0,0 +1,73 @@
+import numpy as np
+from event_handlers import *
+from optimization import *
+
+# Plasma appointments can be made from opening time until an hour before closing time
+APPOINTMENT_HOURS = (closing_time - 60 - opening_time) // 60
+
+# Upper limits of the mean sojourn times and of the mean time that a served donor waits for a bed
+DEFAULT_LIMITS = {'whole blood st': 40, 'plasma st': 90, 'bed wait': 10}
+
+# Number of plasma appointments per hour of a configuration without a schedule
+def default_schedule(config=None):
+    site = BloodCollectionSite({**(config or { }), 'plasma_schedule': None})
+    hours = (np.array(site.plasma_appointments()) - site.opening_time) // 60
+    return tuple(np.bincount(hours.astype(int), minlength=APPOINTMENT_HOURS).tolist())
+
+class ScheduleOptimizer(SuccessiveHalving):
+    '''
+    Searches the plasma appointment schedule (number of appointments per hour and overbooking level) that maximizes the
+    number of served donors, while the mean sojourn times and the mean bed wait stay below their limits.
+    A candidate is a (schedule, overbooking) tuple. Exceeding a limit costs penalty donors per fraction of the limit.
+
+    The n_candidates candidates are the default schedule, flat schedules and random schedules (in this order), at every
+    overbooking level, and are compared with successive halving (see SuccessiveHalving). The whole blood arrivals and
+    service times have their own random streams, so they are the same for every candidate on the same day.
+    '''
+    metrics = ['served', 'whole blood st', 'plasma st', 'bed wait']
+    candidate_name = 'schedule'
+    score_name = 'penalized served'
+
+    def __init__(self, candidates=None, n_candidates=64, max_per_hour=16, overbooking=(0, 0.1, 0.2), limits=None,
+                 penalty=100, base_config=None, eta=2, initial_days=2, max_days=64, seed=3, workers=None):
+        self.base_config = {**DEFAULT_CONFIG, **(base_config or { })}
+        self.limits = {**DEFAULT_LIMITS, **(limits or { })}
+        self.penalty = penalty
+        self.max_per_hour = max_per_hour
+        self.overbooking = overbooking
+        self.rng = np.random.default_rng(seed)
+
+        if candidates is None:
+            candidates = self.generate_candidates(n_candidates)
+        super().__init__(candidates, eta, initial_days, max_days, seed, workers)
+
+    def config(self, candidate):
+        schedule, overbooking = candidate
+        return {**self.base_config, 'plasma_schedule': list(schedule), 'plasma_overbooking': overbooking}
+
+    def score(self, metrics):
+        served, *limited = metrics
+        violation = sum(max(0, value / self.limits[name] - 1) for name, value in zip(self.metrics[1:], limited))
+        # the best candidate has the lowest score
+        return -(served - self.penalty * violation)
+
+    def describe(self, candidate):
+        schedule, overbooking = candidate
+        return {'appointments': round(sum(schedule) * (1 + overbooking))}
+
+    def generate_candidates(self, n_candidates):
+        schedules = [default_schedule(self.base_config)]
+        schedules += [(slots,) * APPOINTMENT_HOURS for slots in range(self.max_per_hour // 2, self.max_per_hour + 1)]
+        while len(schedules) * len(self.overbooking) < n_candidates:
+            schedule = tuple(self.rng.integers(0, self.max_per_hour + 1, APPOINTMENT_HOURS).tolist())
+            if schedule not in schedules:
+                schedules.append(schedule)
+        candidates = [(schedule, overbooking) for schedule in schedules for overbooking in self.overbooking]
+        return candidates[:n_candidates]
+
+if __name__ == '__main__':
+    optimizer = ScheduleOptimizer()
+    best, history = optimizer.optimize()
+    schedule, overbooking = optimizer.best
+    print(f'Best schedule: {schedule}, overbooking {overbooking}')
+    print(history.sort_values(['round', 'penalized served']).groupby('round').head(3))
@@ -0,0 +1,70 @@
+import itertools
+import numpy as np
+from event_handlers import *
+from optimization import *
+
+# The resources of a site that can be chosen, in the order of a candidate tuple
+RESOURCES = ['receptionists', 'doctors', 'nurses', 'beds_plasma', 'beds_blood']
+
+# Costs per day of a single staff member or bed
+DEFAULT_COSTS = {'receptionists': 200, 'doctors': 600, 'nurses': 300, 'beds_plasma': 50, 'beds_blood': 30}
+
+# Smallest and largest number of every resource that is explored
+DEFAULT_BOUNDS = {'receptionists': (1, 3), 'doctors': (1, 5), 'nurses': (1, 3), 'beds_plasma': (5, 12), 'beds_blood': (3, 7)}
+
+def staffing_cost(config, costs=None):
+    costs = costs or DEFAULT_COSTS
+    return sum(costs[resource] * config[resource] for resource in RESOURCES)
+
+class StaffingOptimizer(SuccessiveHalving):
+    '''
+    Searches the numbers of receptionists, doctors, nurses and beds that minimize the weighted mean sojourn time
+    of the whole blood and plasma donors, with a daily cost of at most the budget (by default the cost of DEFAULT_CONFIG).
+
+    Configurations that are dominated, so that another affordable configuration has at least as many of every
+    resource, are eliminated before simulating. The others are compared with successive halving (see SuccessiveHalving).
+    '''
+    metrics = ['whole blood st', 'plasma st']
+    candidate_name = 'configuration'
+    score_name = 'weighted st'
+
+    def __init__(self, budget=None, candidates=None, costs=None, bounds=None, base_config=None, weights=(0.5, 0.5),
+                 eta=2, initial_days=2, max_days=64, seed=3, workers=None, prune_dominated=True):
+        self.costs = {**DEFAULT_COSTS, **(costs or { })}
+        self.bounds = {**DEFAULT_BOUNDS, **(bounds or { })}
+        self.base_config = {**DEFAULT_CONFIG, **(base_config or { })}
+        self.budget = staffing_cost(self.base_config, self.costs) if budget is None else budget
+        self.weights = np.array(weights) / np.sum(weights)
+
+        if candidates is None:
+            candidates = self.generate_candidates(prune_dominated)
+        super().__init__(candidates, eta, initial_days, max_days, seed, workers)
+
+    def config(self, candidate):
+        return {**self.base_config, **dict(zip(RESOURCES, candidate))}
+
+    def cost(self, candidate):
+        return staffing_cost(self.config(candidate), self.costs)
+
+    def score(self, metrics):
+        return metrics @ self.weights
+
+    def describe(self, candidate):
+        return {'cost': self.cost(candidate)}
+
+    def generate_candidates(self, prune_dominated=True):
+        ranges = [range(self.bounds[resource][0], self.bounds[resource][1] + 1) for resource in RESOURCES]
+        candidates = [candidate for candidate in itertools.product(*ranges) if self.cost(candidate) <= self.budget]
+        if not prune_dominated or not candidates:
+            return candidates
+
+        counts = np.array(candidates)
+        return [candidate for candidate, row in zip(candidates, counts)
+                if not np.any(np.all(counts >= row, axis=1) & np.any(counts > row, axis=1))]
+
+if __name__ == '__main__':
+    optimizer = StaffingOptimizer()
+    best, history = optimizer.optimize()
+    print(f'Budget: {optimizer.budget}, {len(optimizer.candidates)} candidates')
+    print(f'Best configuration: {dict(zip(RESOURCES, optimizer.best))}, cost {optimizer.cost(optimizer.best)}')
+    print(history.sort_values(['round', 'weighted st']).groupby('round').head(3))
@@ -1,33 +1,54 @@
 import itertools
+import json
+import time
+from functools import partial
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
 from util import *
 from abc import ABC, abstractmethod
-# Global variable is a design choice: give up testability for less clutter (passing it around to objects and such)
-EVENT_Q = FES()
 
 '''
 A subscription can communicate to what action you want to subscribe.
 Its input is a dictionary. The handler will then only be called if the action has the same shape as self.shape
+
+Subscriptions that only use the keys in INDEXED_KEYS are indexable: whether they match an action only depends on the
+dispatch key of the action, so the system can decide it once per dispatch key instead of once per action.
 '''
 class Subscription:
+    INDEXED_KEYS = {'component', 'staff_member', 'type'}
+
     def __init__(self, shape):
         self.shape = shape
+        self.indexable = set(shape) <= Subscription.INDEXED_KEYS
 
     def is_conform(self, action):
         for key in self.shape:
             if not hasattr(action, key) or getattr(action, key) != self.shape[key]:
                 return False
         return True
+
+    @staticmethod
+    def dispatch_key(action):
+        return (
+            type(action),
+            getattr(action, 'component', None),
+            getattr(action, 'staff_member', None),
+            getattr(action, 'type', None))
         
 '''
 Base object for all actions
+Many actions are created while simulating, so actions (and events and donors) are records with __slots__ instead of
+a dictionary per instance
 '''
 class Action(ABC):
-    pass
+    __slots__ = ()
 
 '''
 Represents a donor entering or leaving a component
 '''
 class DonorAction(Action):
+    __slots__ = ('component', 'donor', 'type')
+
     ENTER = 0
     LEAVE = 1
 
@@ -43,6 +64,8 @@ class DonorAction(Action):
 A StaffAction can occupy or release/free a staff member
 '''
 class StaffAction(Action):
+    __slots__ = ('staff_member', 'type')
+
     OCCUPY = 0
     FREE = 1
 
@@ -59,6 +82,8 @@ class StaffAction(Action):
 A combined actions combines a donor and a staff action as a single action.
 '''
 class CombinedAction(Action):
+    __slots__ = ('donor_action', 'staff_action')
+
     def __init__(self, donor_action, staff_action):
         self.donor_action = donor_action
         self.staff_action = staff_action
@@ -70,24 +95,22 @@ class CombinedAction(Action):
 An Event is a the basis of the simulation.
 It contains a timestamp and an action to be executed on that timestamp
 An action can cause other actions to execute at the same time instant. We keep track of all actions in executed_actions
-
-NOTE: Instantiating an event immediately puts it on the global event queue.
 '''
 class Event:
+    __slots__ = ('time', 'action', 'executed_actions')
+
     def __init__(self, time, action):
         self.time = time
         self.action = action
         self.executed_actions = []
-        EVENT_Q.enqueue(self)
-
-    def __lt__(self, other):
-        return self.time < other.time
 
 '''
 Donors go through a system. They are created once, and can then enter and leave components.
 A Donor is of a donor type, and can be accepted or rejected after an interview
 '''
 class Donor:
+    __slots__ = ('id', 'type', 'accepted', 'arrival_time')
+
     ID = itertools.count().__next__
 
     WHOLE_BLOOD = 0
@@ -140,10 +163,14 @@ class Component(ABC):
 '''
 A queue is a component that represents a queue within the system. It does not have to be physical location,
 it just signifies that there is a collection of donors waiting on something
+
+The donors are kept in insertion ordered dictionaries, one for the whole queue and one per donor type,
+so finding the first (of a type), entering and leaving are all O(1)
 '''
 class Q(Component):
     def init(self):
-        self.queue = []
+        self.queue = OrderedDict()
+        self.queues_by_type = { }
 
     def size(self):
         return len(self.queue)
@@ -152,20 +179,26 @@ class Q(Component):
         return self.size() == 0
 
     def first(self):
-        return self.queue[0]
+        for donor in self.queue:
+            return donor
+        raise IndexError(f'{self} is empty')
 
     def first_of_type(self, donor_type):
-        for donor in self.queue:
-            if donor.type == donor_type:
-                return donor
+        for donor in self.queues_by_type.get(donor_type, ()):
+            return donor
+        return None
 
     def enter(self, donor):
         super().enter(donor)
-        self.queue.append(donor)
+        self.queue[donor] = None
+        if donor.type not in self.queues_by_type:
+            self.queues_by_type[donor.type] = OrderedDict()
+        self.queues_by_type[donor.type][donor] = None
 
     def leave(self, donor):
         super().leave(donor)
-        self.queue.remove(donor)
+        del self.queue[donor]
+        del self.queues_by_type[donor.type][donor]
     
     def __str__(self):
         return f'{self.name} queue'
@@ -185,30 +218,259 @@ A Staff member is either a nurse or a doctor, and they generally help donors tha
 A Staff member can be activated on specific actions, or when they are freed (= no longer occupied)
 '''
 class StaffMember:
-    def __init__(self, job, name):
+    def __init__(self, job, name, system=None):
         self.name = name
         self.job = job
         self.occupied = False
         self.subscriptions = []
         self.policy = lambda x: x
+        # the system is notified of new subscriptions, so it can update its dispatch index
+        self.system = system
+        # position in system.staff, and the staff pools this staff member is part of (when idle)
+        self.rank = None
+        self.pools = []
         self.subscribe(Subscription({'staff_member': self}))
 
     def subscribe(self, subscription):
         self.subscriptions.append(subscription)
+        if self.system is not None:
+            self.system.invalidate_dispatch()
 
     def handle_action(self, time, action, action_builder):
-        if self.occupied:
-            return False
-
         # The policy should only run once, so we return as soon as we find a subscription match
         for subscription in self.subscriptions:
             if subscription.is_conform(action):
-                self.policy(self, time, action, action_builder)
-                return True   
+                return self.act(time, action, action_builder)
+
+    # Runs the policy, unless the staff member is occupied
+    def act(self, time, action, action_builder):
+        if self.occupied:
+            return False
+
+        self.policy(self, time, action, action_builder)
+        return True
+
+    def __str__(self):
+        return self.name
+
+'''
+A StaffPool contains the idle staff members that are subscribed to the same dispatch key, ordered like system.staff.
+The system removes staff members from their pools when they are occupied, and adds them again when they are freed,
+so occupied staff members are never offered an action.
+'''
+class StaffPool:
+    def __init__(self):
+        self.ranks = []
+        self.members = { }
+
+    def add(self, member):
+        index = bisect_left(self.ranks, member.rank)
+        if index == len(self.ranks) or self.ranks[index] != member.rank:
+            self.ranks.insert(index, member.rank)
+            self.members[member.rank] = member
+
+    def remove(self, member):
+        index = bisect_left(self.ranks, member.rank)
+        if index < len(self.ranks) and self.ranks[index] == member.rank:
+            del self.ranks[index]
+            del self.members[member.rank]
+
+    def __iter__(self):
+        # Staff members can be occupied or freed while iterating, so the next member is searched by rank every time
+        rank = -1
+        while True:
+            index = bisect_right(self.ranks, rank)
+            if index == len(self.ranks):
+                return
+            rank = self.ranks[index]
+            yield self.members[rank]
+
+    def __len__(self):
+        return len(self.ranks)
+
+'''
+A Resource has a number of identical units (for example beds) that can be acquired and released in O(1).
+If no unit is available, the waiter that tries to acquire one is put in a FIFO wait list, and the next release hands
+the unit directly to the first waiter instead of making it available.
+The number of units in use is tracked over time, so the time weighted utilization is available at any moment.
+'''
+class Resource:
+    def __init__(self, name, capacity, start_time=0):
+        self.name = name
+        self.capacity = capacity
+        self.available = capacity
+        self.waiting = deque()
+        self.start_time = start_time
+        self.last_time = start_time
+        self.busy_area = 0.0
+
+    @property
+    def in_use(self):
+        return self.capacity - self.available
+
+    def update(self, time):
+        self.busy_area += self.in_use * (time - self.last_time)
+        self.last_time = time
+
+    # Returns whether a unit is acquired, otherwise the waiter (if given) waits for the next released unit
+    def acquire(self, time, waiter=None):
+        if self.available > 0:
+            self.update(time)
+            self.available -= 1
+            return True
+
+        if waiter is not None:
+            self.waiting.append(waiter)
+        return False
+
+    # Returns the waiter that gets the released unit, or None if the unit became available
+    def release(self, time):
+        if self.waiting:
+            return self.waiting.popleft()
+
+        if self.available == self.capacity:
+            raise RuntimeError(f'Cannot release a unit of {self}, because no unit is in use')
+        self.update(time)
+        self.available += 1
+        return None
+
+    # Time weighted fraction of the units that is in use, from the start time until end_time
+    def utilization(self, end_time=None):
+        end_time = self.last_time if end_time is None else end_time
+        if end_time <= self.start_time or self.capacity == 0:
+            return 0.0
+        busy_area = self.busy_area + self.in_use * (end_time - self.last_time)
+        return busy_area / (self.capacity * (end_time - self.start_time))
+
+    def __str__(self):
+        return self.name
+
+'''
+A ResourcePool is a resource that is partitioned by type, for example beds for plasma and for whole blood donors.
+Every partition is a Resource with its own capacity and wait list.
+'''
+class ResourcePool:
+    def __init__(self, name, capacities, start_time=0):
+        self.name = name
+        self.resources = {partition: Resource(f'{name} ({partition})', capacity, start_time)
+                          for partition, capacity in capacities.items()}
+
+    def acquire(self, partition, time, waiter=None):
+        return self.resources[partition].acquire(time, waiter)
+
+    def release(self, partition, time):
+        return self.resources[partition].release(time)
+
+    def available(self, partition):
+        return self.resources[partition].available
+
+    # Utilization per partition
+    def utilization(self, end_time=None):
+        return {partition: resource.utilization(end_time) for partition, resource in self.resources.items()}
+
+    def __getitem__(self, partition):
+        return self.resources[partition]
 
     def __str__(self):
         return self.name
 
+'''
+An Observer is notified of every executed action exactly once, as it is executed, and of every event after all its
+actions have been executed. This way metrics can be computed while simulating, instead of afterwards from all events.
+'''
+class Observer:
+    def on_action(self, time, action): pass
+
+    def on_event(self, event): pass
+
+'''
+A HandlerProfiler is opt-in instrumentation of a system (see Simulator). It measures the wall time and counts the calls
+of every subscription handler and staff policy (by the name of their function), with the number of actions they build
+and events they schedule, and it keeps the cascade depth and the number of actions of every event.
+The time of the events that is not spent in handlers and policies is the time of the framework itself: dispatching,
+executing actions and notifying observers.
+'''
+class HandlerProfiler:
+    def __init__(self, json_file=None):
+        self.json_file = json_file
+        self.names = { }
+        self.handlers = { }
+        self.events = 0
+        self.event_time = 0.0
+        self.depths = { }
+        self.actions_per_event = { }
+
+    # The name of the function of a handler or policy, which can be a partial
+    def name_of(self, target):
+        name = self.names.get(target)
+        if name is None:
+            function = target
+            while isinstance(function, partial):
+                function = function.func
+            name = self.names[target] = getattr(function, '__name__', repr(function))
+        return name
+
+    # Calls function(*args) on behalf of the handler or policy target, and records its time and results
+    def call(self, target, kind, builder, function, *args):
+        event_q = builder.event_q
+        scheduled = len(event_q) if event_q is not None else 0
+
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+
+        name = self.name_of(target)
+        totals = self.handlers.get(name)
+        if totals is None:
+            totals = self.handlers[name] = {'kind': kind, 'calls': 0, 'time': 0.0, 'actions': 0, 'scheduled': 0}
+        totals['calls'] += 1
+        totals['time'] += elapsed
+        totals['actions'] += len(builder.actions)
+        totals['scheduled'] += (len(event_q) if event_q is not None else 0) - scheduled
+        return result
+
+    def on_event(self, elapsed, depth, n_actions):
+        self.events += 1
+        self.event_time += elapsed
+        self.depths[depth] = self.depths.get(depth, 0) + 1
+        self.actions_per_event[n_actions] = self.actions_per_event.get(n_actions, 0) + 1
+
+    @staticmethod
+    def summary(histogram):
+        total = sum(histogram.values())
+        return {
+            'mean': sum(value * count for value, count in histogram.items()) / total if total > 0 else 0.0,
+            'max': max(histogram, default=0),
+            'histogram': dict(sorted(histogram.items()))
+        }
+
+    def report(self):
+        handlers = { }
+        for name, totals in sorted(self.handlers.items(), key=lambda item: -item[1]['time']):
+            handlers[name] = {
+                **totals,
+                'mean_time': totals['time'] / totals['calls'],
+                'share': totals['time'] / self.event_time if self.event_time > 0 else 0.0,
+                'actions_per_call': totals['actions'] / totals['calls']
+            }
+
+        handler_time = sum(totals['time'] for totals in self.handlers.values())
+        report = {
+            'events': self.events,
+            'event_time': self.event_time,
+            'events_per_second': self.events / self.event_time if self.event_time > 0 else 0.0,
+            'handlers': handlers,
+            'framework_time': self.event_time - handler_time,
+            'framework_share': (self.event_time - handler_time) / self.event_time if self.event_time > 0 else 0.0,
+            'cascade_depth': self.summary(self.depths),
+            'actions_per_event': self.summary(self.actions_per_event)
+        }
+
+        if self.json_file is not None:
+            with open(self.json_file, 'w') as json_file:
+                json.dump(report, json_file, indent=2, default=float)
+        return report
+
 '''
 The system is a collection of components and staffmembers, with user defined behaviour.
 It contains components, but is a component itself as well (because donors can enter and leave)
@@ -219,6 +481,11 @@ class System(Component):
         self.subscriptions = []
         self.arrivals = []
         self.time = 0
+        self.dispatch_index = { }
+        self.observers = []
+        # the event queue of the simulator that is simulating this system
+        self.event_q = None
+        self.profiler = None
 
     def re_init(self):
         self.arrivals = []
@@ -231,13 +498,65 @@ class System(Component):
         section = Section(name)
         return section
 
+    def createResourcePool(self, name, capacities, start_time=0):
+        pool = ResourcePool(name, capacities, start_time)
+        return pool
+
     def createStaff(self, job, name):
-        member = StaffMember(job, name)
+        member = StaffMember(job, name, self)
+        member.rank = len(self.staff)
         self.staff.append(member)
+        self.invalidate_dispatch()
         return member
 
     def subscribe(self, subscription, handler):
         self.subscriptions.append((subscription, handler))
+        self.invalidate_dispatch()
+
+    def invalidate_dispatch(self):
+        self.dispatch_index = { }
+        for member in self.staff:
+            member.pools = []
+
+    # Returns the staff members and handlers that (may) have to handle the action.
+    # The result is computed once per dispatch key, and then looked up in the dispatch index.
+    def dispatch_entry(self, action):
+        key = Subscription.dispatch_key(action)
+        entry = self.dispatch_index.get(key)
+        if entry is None:
+            entry = self.dispatch_index[key] = self.build_dispatch_entry(action)
+        return entry
+
+    def build_dispatch_entry(self, action):
+        # The staff members that are subscribed are put in a pool, from which they are removed while occupied.
+        # For staff members without a matching indexable subscription, the other subscriptions still need to be checked.
+        pool = StaffPool()
+        staff_subscriptions = { }
+        for member in self.staff:
+            if not any(subscription.indexable and subscription.is_conform(action) for subscription in member.subscriptions):
+                subscriptions = [subscription for subscription in member.subscriptions if not subscription.indexable]
+                if not subscriptions:
+                    continue
+                staff_subscriptions[member] = subscriptions
+
+            member.pools.append(pool)
+            if not member.occupied:
+                pool.add(member)
+
+        handlers = []
+        for subscription, handler in self.subscriptions:
+            if not subscription.indexable:
+                handlers.append((subscription, handler))
+            elif subscription.is_conform(action):
+                handlers.append((None, handler))
+
+        return pool, staff_subscriptions, handlers
+
+    def observe(self, observer):
+        self.observers.append(observer)
+
+    def unobserve(self, observer):
+        self.observers.remove(observer)
 
     def add_arrival(self, time, donor):
         self.arrivals.append((time, DonorAction(self, donor, DonorAction.ENTER)))
@@ -251,8 +570,12 @@ class System(Component):
         if type(action) is StaffAction:
             if action.type == StaffAction.OCCUPY:
                 action.staff_member.occupied = True
+                for pool in action.staff_member.pools:
+                    pool.remove(action.staff_member)
             elif action.type == StaffAction.FREE:
                 action.staff_member.occupied = False
+                for pool in action.staff_member.pools:
+                    pool.add(action.staff_member)
             else:
                 raise RuntimeError(f'Unknown StaffAction type: {action.type}')
             return
@@ -271,25 +594,35 @@ class System(Component):
             yield from self.check_subscriptions(action.staff_action)
             return
 
-        covered = False
-        for member in self.staff:
-            # if not covered:
-            builder = ActionBuilder()
-            covered = member.handle_action(self.time, action, builder)
+        pool, staff_subscriptions, handlers = self.dispatch_entry(action)
+
+        for member in pool:
+            subscriptions = staff_subscriptions.get(member)
+            if subscriptions is not None and not any(subscription.is_conform(action) for subscription in subscriptions):
+                continue
+
+            builder = ActionBuilder(self.event_q)
+            if self.profiler is None:
+                member.act(self.time, action, builder)
+            else:
+                self.profiler.call(member.policy, 'policy', builder, member.act, self.time, action, builder)
             yield from builder.actions
 
-        for subscription, handler in self.subscriptions:
-            if not subscription.is_conform(action):
+        for subscription, handler in handlers:
+            if subscription is not None and not subscription.is_conform(action):
                 continue
 
-            builder = ActionBuilder()
+            builder = ActionBuilder(self.event_q)
 
             if type(action) is DonorAction:
                 builder.use_donor(action.donor)
             elif type(action) is StaffAction:
                 builder.use_staff(action.staff_member)
 
-            handler(self.time, action, builder)
+            if self.profiler is None:
+                handler(self.time, action, builder)
+            else:
+                self.profiler.call(handler, 'handler', builder, handler, self.time, action, builder)
             yield from builder.actions
 
     def handle_event(self, event):
@@ -298,8 +631,16 @@ class System(Component):
         action_queue = [event.action]
         index = 0
 
+        # with a profiler, the cascade depth of every action is kept: the depth of the action it responds to plus one
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+            depths = [0]
+
         # Execute the initial action
         self.execute_action(event.action)
+        for observer in self.observers:
+            observer.on_action(self.time, event.action)
 
         # All actions that are added to the queue will be executed as soon as they are added,
         # but the actions will be checked one-by-one for subscriptions
@@ -312,22 +653,42 @@ class System(Component):
             for response_action in response_actions:
                 self.execute_action(response_action)
                 action_queue.append(response_action)
+                if profiler is not None:
+                    depths.append(depths[index - 1] + 1)
+                for observer in self.observers:
+                    observer.on_action(self.time, response_action)
 
         # store all executed actions in the event that triggered them
         event.executed_actions = action_queue
 
+        for observer in self.observers:
+            observer.on_event(event)
+
+        if profiler is not None:
+            profiler.on_event(time.perf_counter() - start, max(depths), len(action_queue))
+
 '''
 An ActionBuilder is passed to the user-defined event handlers
 They can either perform an action as a direct response to the event (will be stored in event.executed_actions),
-or enqueue a new event
+or enqueue a new event on the given event queue
+The action that is being built is kept in the pending_* attributes, until it is built
 '''
 class ActionBuilder:
-    def __init__(self, component=None, donor=None, staff_member=None):
+    __slots__ = ('event_q', 'component', 'donor', 'staff_member', 'actions',
+                 'pending_donor_action', 'pending_staff_action', 'pending_time')
+
+    def __init__(self, event_q=None, component=None, donor=None, staff_member=None):
+        self.event_q = event_q
         self.component = component
         self.donor = donor
         self.staff_member = staff_member
         self.actions = []
-        self.action_data = { }
+        self.reset()
+
+    def reset(self):
+        self.pending_donor_action = None
+        self.pending_staff_action = None
+        self.pending_time = None
 
     # Use this donor for creating actions
     def use_donor(self, donor):
@@ -343,46 +704,48 @@ class ActionBuilder:
 
     def enter(self, component=None, donor=None):
         component, donor, _ = self.resolve(component, donor)
-        self.action_data['donor_action'] = DonorAction(component, donor, DonorAction.ENTER)
+        self.pending_donor_action = DonorAction(component, donor, DonorAction.ENTER)
         return self
 
     def leave(self, component=None, donor=None):
         component, donor, _ = self.resolve(component, donor)
-        self.action_data['donor_action'] = DonorAction(component, donor, DonorAction.LEAVE)
+        self.pending_donor_action = DonorAction(component, donor, DonorAction.LEAVE)
         return self
 
     def occupy_staff(self, staff_member=None):
         _, _, staff_member = self.resolve(staff_member=staff_member)
-        self.action_data['staff_action'] = StaffAction(staff_member, StaffAction.OCCUPY)
+        self.pending_staff_action = StaffAction(staff_member, StaffAction.OCCUPY)
         return self
 
     def free_staff(self, staff_member=None):
         _, _, staff_member = self.resolve(staff_member=staff_member)
-        self.action_data['staff_action'] = StaffAction(staff_member, StaffAction.FREE)
+        self.pending_staff_action = StaffAction(staff_member, StaffAction.FREE)
         return self
 
     def at(self, time):
-        self.action_data['time'] = time
+        self.pending_time = time
         return self
 
     def build(self):
-        action = None
-
-        if 'donor_action' in self.action_data and 'staff_action' in self.action_data:
-            action = CombinedAction(self.action_data['donor_action'], self.action_data['staff_action'])
-        elif 'donor_action' in self.action_data:
-            action = self.action_data['donor_action']
-        elif 'staff_action' in self.action_data:
-            action = self.action_data['staff_action']
+        donor_action, staff_action = self.pending_donor_action, self.pending_staff_action
+
+        if donor_action is not None and staff_action is not None:
+            action = CombinedAction(donor_action, staff_action)
+        elif donor_action is not None:
+            action = donor_action
+        elif staff_action is not None:
+            action = staff_action
         else:
             raise RuntimeError('Cannot build action, because there is no action specified')
 
-        if 'time' in self.action_data:
-            Event(self.action_data['time'], action)
+        if self.pending_time is not None:
+            if self.event_q is None:
+                raise RuntimeError('Cannot schedule an event, because the system is not being simulated')
+            self.event_q.enqueue(Event(self.pending_time, action))
         else:
             self.actions.append(action)
 
-        self.action_data = { }
+        self.reset()
 
     def resolve(self, component=None, donor=None, staff_member=None):
         return (
@@ -392,24 +755,56 @@ class ActionBuilder:
 
 '''
 A simulator takes a system object and simulates a system. It will stop when the event queue is empty
+
+Every simulator has its own event queue, so several simulators (of different systems) can exist at the same time.
+The observers are attached to the system while simulating. If keep_events is False, handled events are not stored,
+which keeps the memory usage constant when all metrics are computed by observers.
+The event queue is a FES by default, for very many pending events a CalendarQueue can be given instead.
+With a HandlerProfiler, the handlers and policies are profiled while simulating, and profile_report is its report.
 '''
 class Simulator:
-    def __init__(self, system):
+    def __init__(self, system, observers=(), keep_events=True, event_q=None, profiler=None):
         self.system = system
+        self.event_q = FES() if event_q is None else event_q
+        self.profiler = profiler
+        self.profile_report = None
         self.time = 0 # Note: the initial value can actually be anything as events will overwrite it
         self.handled_events = []
+        self.observers = list(observers)
+        self.keep_events = keep_events
+        self.n_events = 0
+        self.n_actions = 0
 
     def simulate(self):
-        EVENT_Q.clear()
+        self.event_q.clear()
         self.handled_events = []
+        self.n_events = 0
+        self.n_actions = 0
 
         for arrival_time, action in self.system.arrivals:
-            Event(arrival_time, action)
-
-        while not EVENT_Q.is_empty():
-            event = EVENT_Q.pop()
-            self.time = event.time
-            self.system.handle_event(event)
-            self.handled_events.append(event)
+            self.event_q.enqueue(Event(arrival_time, action))
+
+        self.system.event_q = self.event_q
+        self.system.profiler = self.profiler
+        for observer in self.observers:
+            self.system.observe(observer)
+
+        try:
+            while not self.event_q.is_empty():
+                event = self.event_q.pop()
+                self.time = event.time
+                self.system.handle_event(event)
+                self.n_events += 1
+                self.n_actions += len(event.executed_actions)
+                if self.keep_events:
+                    self.handled_events.append(event)
+        finally:
+            self.system.event_q = None
+            self.system.profiler = None
+            for observer in self.observers:
+                self.system.unobserve(observer)
+
+        if self.profiler is not None:
+            self.profile_report = self.profiler.report()
 
         return self.handled_events
\ No newline at end of file
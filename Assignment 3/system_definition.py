@@ -2,32 +2,13 @@ import numpy as np
 from system import *
 from scipy.stats import truncnorm, expon
 
-system = System('Blood collection site')
-registration_line  = system.createSection('Registration line')
-question_room      = system.createSection('Questionnaire room')
-pre_interview_room = system.createSection('Pre-interview room')
-pre_donation_room  = system.createSection('Pre-donation room')
-donation_room      = system.createSection('Donation room')
-registration_q = system.createQ('Registration')
-interview_q    = system.createQ('Pre-interview')
-donation_q     = system.createQ('Donation')
-connect_q      = system.createQ('Connect')
-disconnect_q   = system.createQ('Disconnect')
-receptionists = [
-    system.createStaff('Receptionist', 'Receptionist 1'),
-    # system.createStaff('Receptionist', 'Receptionist 2')
-]
-doctors = [
-    system.createStaff('Doctor', 'Doctor 1'),
-    system.createStaff('Doctor', 'Doctor 2'),
-    system.createStaff('Doctor', 'Doctor 3'),
-]
-nurses = [
-    system.createStaff('Nurse', 'Nurse 1'),
-    # system.createStaff('Nurse', 'Nurse 2'),
-    # system.createStaff('Nurse', 'Nurse 3'),
-    # system.createStaff('Nurse', 'Nurse 4')
-]
+opening_time = 8 * 60
+closing_time = 20 * 60
+
+# Arrival rates per minute of whole blood donors, which are constant during blocks of 30 minutes from opening time
+ARRIVAL_RATES = np.array([5.76, 5.94, 7.20, 7.56, 8.28, 7.56, 5.94, 5.40, 5.22, 5.76, 6.66, 7.56, 7.74,
+                          6.84, 6.12, 6.30, 6.84, 6.66, 10.44, 8.64, 9.18, 12.24, 12.6, 7.56]) / 30
+ARRIVAL_BLOCKS = opening_time + 30 * np.arange(len(ARRIVAL_RATES) + 1)
 
 # Returns the arrival rate per minute of whole blood donors
 def arrival_rate_at(time):
@@ -38,21 +19,119 @@ def arrival_rate_at(time):
     time -= opening_time
     index = 0 if time == 0 else int((time-1) // 30)
 
-    return [5.76, 5.94, 7.20, 7.56, 8.28, 7.56, 5.94, 5.40, 5.22, 5.76, 6.66, 7.56, 7.74,\
-            6.84, 6.12, 6.30, 6.84, 6.66, 10.44, 8.64, 9.18, 12.24, 12.6, 7.56][index] / 30
+    return ARRIVAL_RATES[index]
 
-dist_registration = truncnorm(0, np.infty, 2.0, 0.5)
-dist_questionnaire = expon(scale=1/1.5)
-dist_interview = truncnorm(0, np.infty, 6.0, 1.0)
-dist_connect = expon(scale=1/3.0)
-dist_whole_blood = truncnorm(0, np.infty, 8.5, 0.6)
-dist_plasma = truncnorm(0, np.infty, 45.0, 6.0)
-dist_disconnect = expon(scale=1/2.0)
-dist_recover = expon(scale=1/4.0)
-dist_arrivals = NHPP(arrival_rate_at, 13/30)
+DEFAULT_CONFIG = {
+    'name': 'Blood collection site',
+    'receptionists': 1,
+    'doctors': 3,
+    'nurses': 1,
+    'beds_plasma': 9,
+    'beds_blood': 5,
+    'plasma_interval': 5,          # minutes between two plasma appointments
+    'plasma_slots': 110,           # maximum number of plasma appointments
+    'plasma_show_up': 0.85,        # probability that a plasma donor shows up
+    'plasma_schedule': None,       # number of plasma appointments per hour from opening time, replaces the interval
+    'plasma_overbooking': 0.0,     # fraction of extra appointments per hour of the schedule
+    'rejection_probability': 0.05, # probability that a donor is rejected during the interview
+    'arrival_rates': None,         # whole blood arrival rates per minute of every 30 minutes, ARRIVAL_RATES if None
+    'arrival_scale': 1             # factor of the whole blood arrival rates
+}
 
-opening_time = 8 * 60
-closing_time = 20 * 60
+# Every source of randomness has its own random number stream, spawned from the seed of the site
+STREAMS = ['plasma_show_up', 'whole_blood_arrivals', 'rejection', 'registration', 'questionnaire', 'interview',
+           'connect', 'whole_blood', 'plasma', 'disconnect', 'recover']
+
+'''
+A BloodCollectionSite is an instance of the model: a system with its components and staff, the bed counters,
+the service time distributions and the random number streams. Every site is independent of the others,
+so several sites (or simulations of the same configuration) can exist in one process.
+
+The configuration overrides the values in DEFAULT_CONFIG.
+'''
+class BloodCollectionSite:
+    def __init__(self, config=None, seed=None):
+        self.config = {**DEFAULT_CONFIG, **(config or { })}
+        # arrays in the configuration are stored as lists, so the configuration can be saved as JSON (see replay.py)
+        for key in ['arrival_rates', 'plasma_schedule']:
+            if isinstance(self.config[key], np.ndarray):
+                self.config[key] = self.config[key].tolist()
+        self.opening_time = opening_time
+        self.closing_time = closing_time
+
+        system = self.system = System(self.config['name'])
+        self.registration_line  = system.createSection('Registration line')
+        self.question_room      = system.createSection('Questionnaire room')
+        self.pre_interview_room = system.createSection('Pre-interview room')
+        self.pre_donation_room  = system.createSection('Pre-donation room')
+        self.donation_room      = system.createSection('Donation room')
+        self.registration_q = system.createQ('Registration')
+        self.interview_q    = system.createQ('Pre-interview')
+        self.donation_q     = system.createQ('Donation')
+        self.connect_q      = system.createQ('Connect')
+        self.disconnect_q   = system.createQ('Disconnect')
+        self.receptionists = [system.createStaff('Receptionist', f'Receptionist {i+1}') for i in range(self.config['receptionists'])]
+        self.doctors = [system.createStaff('Doctor', f'Doctor {i+1}') for i in range(self.config['doctors'])]
+        self.nurses = [system.createStaff('Nurse', f'Nurse {i+1}') for i in range(self.config['nurses'])]
+
+        self.beds = system.createResourcePool(
+            'Beds', {Donor.PLASMA: self.config['beds_plasma'], Donor.WHOLE_BLOOD: self.config['beds_blood']}, opening_time)
+        self.n_donors = 0
+
+        # the seed can also be a SeedSequence, for example one spawned for a replication. It is copied before
+        # spawning the streams, so sites with the same SeedSequence get the same streams (common random numbers).
+        self.seed = seed
+        if isinstance(seed, np.random.SeedSequence):
+            seed_sequence = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key)
+        else:
+            seed_sequence = np.random.SeedSequence(seed)
+        seeds = seed_sequence.spawn(len(STREAMS))
+        self.streams = {name: np.random.default_rng(stream_seed) for name, stream_seed in zip(STREAMS, seeds)}
+
+        self.dist_registration = self.distribution(truncnorm(0, np.infty, 2.0, 0.5), 'registration')
+        self.dist_questionnaire = self.distribution(expon(scale=1/1.5), 'questionnaire')
+        self.dist_interview = self.distribution(truncnorm(0, np.infty, 6.0, 1.0), 'interview')
+        self.dist_connect = self.distribution(expon(scale=1/3.0), 'connect')
+        self.dist_whole_blood = self.distribution(truncnorm(0, np.infty, 8.5, 0.6), 'whole_blood')
+        self.dist_plasma = self.distribution(truncnorm(0, np.infty, 45.0, 6.0), 'plasma')
+        self.dist_disconnect = self.distribution(expon(scale=1/2.0), 'disconnect')
+        self.dist_recover = self.distribution(expon(scale=1/4.0), 'recover')
+        arrival_rates = ARRIVAL_RATES if self.config['arrival_rates'] is None else self.config['arrival_rates']
+        arrival_rates = np.asarray(arrival_rates) * self.config['arrival_scale']
+        self.dist_arrivals = PiecewiseNHPP(ARRIVAL_BLOCKS, arrival_rates, self.streams['whole_blood_arrivals'])
+
+    # Lets a (frozen) distribution draw from one of the random number streams of the site, in blocks of variates
+    def distribution(self, dist, stream):
+        dist.random_state = self.streams[stream]
+        return VariatePool(dist)
+
+    # Adds the arrivals of one day to the system
+    def add_arrivals(self):
+        self.system.re_init()
+        # add plasma donor arrivals
+        for t in self.plasma_appointments():
+            if self.streams['plasma_show_up'].random() <= self.config['plasma_show_up']:
+                self.add_donor(t, Donor.PLASMA)
+        # add whole blood donor arrivals
+        arrival_times = self.dist_arrivals.between(self.opening_time, self.closing_time)
+        for arrival_time in arrival_times:
+            self.add_donor(arrival_time, Donor.WHOLE_BLOOD)
+
+    # Times of the plasma appointments. Without a schedule there is an appointment every plasma_interval minutes until
+    # an hour before closing time, at most plasma_slots. The appointments of an hour of the schedule (increased by the
+    # overbooking) are spread evenly over the hour.
+    def plasma_appointments(self):
+        schedule = self.config['plasma_schedule']
+        if schedule is None:
+            times = range(self.opening_time, self.closing_time - 60, self.config['plasma_interval'])
+            return list(times)[:self.config['plasma_slots']]
+
+        times = []
+        for hour, slots in enumerate(schedule):
+            n = round(slots * (1 + self.config['plasma_overbooking']))
+            times += [self.opening_time + 60 * hour + 60 * i / n for i in range(n)]
+        return times
 
-available_beds_plasma = 9
-available_beds_blood = 5
\ No newline at end of file
+    def add_donor(self, time, donor_type):
+        self.system.add_arrival(time, Donor(time, donor_type))
+        self.n_donors += 1
@@ -3,57 +3,218 @@ from collections import deque
 from math import sin, pi 
 import matplotlib.pyplot as plt
 import heapq
+import numpy as np
+import itertools
 
-# Simulates a non-homogenous poisson process
+# Simulates a non-homogenous poisson process by thinning. If the rate function is vectorized (accepts and returns
+# arrays), all candidates are judged at once, otherwise it is called for every candidate.
 class NHPP:
-    def __init__(self, rate_function, max_rate):
+    def __init__(self, rate_function, max_rate, random_state=None, vectorized=False):
         self.rate_function = rate_function
         self.max_rate = max_rate
+        self.vectorized = vectorized
         self.exp_dist = expon(scale=1/max_rate)
         self.uni_dist = uniform(0, 1)
+        if random_state is not None:
+            self.exp_dist.random_state = random_state
+            self.uni_dist.random_state = random_state
 
     def between(self, start, end):
-        arrivals = deque()
-        time = start
+        # draw the candidates of the homogeneous process in batches, until the end is passed
+        expected = self.max_rate * (end - start)
+        batch = int(expected + 4 * np.sqrt(expected)) + 10
+        times = start + np.cumsum(self.exp_dist.rvs(size=batch))
+        while times[-1] <= end:
+            times = np.concatenate([times, times[-1] + np.cumsum(self.exp_dist.rvs(size=batch))])
+        times = times[times <= end]
 
-        while True:
-            time += self.exp_dist.rvs()
-            if time > end:
-                break
+        if self.vectorized:
+            rates = self.rate_function(times)
+        else:
+            rates = np.fromiter(map(self.rate_function, times), float, len(times))
 
-            accept = self.max_rate * self.uni_dist.rvs() < self.rate_function(time)
-            if accept:
-                arrivals.append(time)
+        accept = self.max_rate * self.uni_dist.rvs(size=len(times)) < rates
+        return times[accept].tolist()
 
-        return list(arrivals)
+# Simulates a non-homogenous poisson process with a rate that is constant between the edges of blocks: rates[i]
+# between edges[i] and edges[i+1], and 0 outside of the edges. The number of arrivals in every block is poisson
+# distributed, and given that number the arrivals are uniformly distributed over the block.
+class PiecewiseNHPP:
+    def __init__(self, edges, rates, random_state=None):
+        self.edges = np.asarray(edges, dtype=float)
+        self.rates = np.asarray(rates, dtype=float)
+        self.random_state = np.random.default_rng() if random_state is None else random_state
 
+    def between(self, start, end):
+        lows = np.clip(self.edges[:-1], start, end)
+        lengths = np.clip(self.edges[1:], start, end) - lows
+
+        counts = self.random_state.poisson(self.rates * lengths)
+        times = np.repeat(lows, counts) + self.random_state.random(counts.sum()) * np.repeat(lengths, counts)
+        times.sort()
+        return times.tolist()
+
+# Serves variates of a (frozen) distribution that are drawn in blocks, since every rvs() call of a scipy distribution
+# has a large overhead. The variates come from the random_state of the distribution, and rvs() can be used like the
+# rvs() of the distribution itself.
+class VariatePool:
+    def __init__(self, dist, block_size=512):
+        self.dist = dist
+        self.block_size = block_size
+        self.values = []
+        self.index = 0
+
+    def refill(self):
+        self.values = self.dist.rvs(size=self.block_size).tolist()
+        self.index = 0
+
+    def rvs(self, size=None):
+        if size is None:
+            if self.index == len(self.values):
+                self.refill()
+            value = self.values[self.index]
+            self.index += 1
+            return value
+
+        values = np.empty(int(np.prod(size)))
+        filled = 0
+        while filled < len(values):
+            if self.index == len(self.values):
+                self.refill()
+            n = min(len(values) - filled, len(self.values) - self.index)
+            values[filled:filled + n] = self.values[self.index:self.index + n]
+            self.index += n
+            filled += n
+        return values.reshape(size)
 
 # copied and adapted from lecture notes
+# Events are stored as (time, priority, sequence number, event) tuples. Events at the same time are popped by
+# priority (lowest first) and then in the order they were enqueued, so a run is reproducible, and the heap compares
+# tuples of numbers in C instead of calling a method of the events.
 class FES:
     def __init__(self):
         self.events = []
+        self.sequence = itertools.count()
 
-    def enqueue(self, event):
-        heapq.heappush(self.events, event)
+    def enqueue(self, event, priority=0):
+        heapq.heappush(self.events, (event.time, priority, next(self.sequence), event))
 
     def pop(self):
         self.ensure_not_empty()
-        return heapq.heappop(self.events)
+        return heapq.heappop(self.events)[-1]
 
     def peek(self):
         self.ensure_not_empty()
-        return self.events[0]
+        return self.events[0][-1]
 
     def clear(self):
         self.events = []
+        self.sequence = itertools.count()
 
     def is_empty(self):
         return len(self.events) == 0
 
+    def __len__(self):
+        return len(self.events)
+
     def ensure_not_empty(self):
         if len(self.events) == 0:
             raise RuntimeError('The queue is empty')
 
+'''
+A calendar queue (R. Brown, 1988) with the same interface and ordering as FES, for very many pending events.
+Time is divided into buckets of bucket_width; a bucket contains the events of every bucket_width * n_buckets ("year")
+that fall in it, as a heap of the same tuples as FES. Popping scans the buckets from the current one, so enqueue and
+pop take constant time on average instead of O(log n). The number of buckets doubles or halves with the number of
+events, and the bucket width is then estimated from the mean separation of the events. The same happens when a whole
+year passes without events, or when popping scans many empty buckets.
+'''
+class CalendarQueue:
+    def __init__(self, bucket_width=1.0, n_buckets=64):
+        self.initial_width = bucket_width
+        self.initial_buckets = n_buckets
+        self.clear()
+
+    def clear(self):
+        self.width = self.initial_width
+        self.buckets = [[] for _ in range(self.initial_buckets)]
+        self.size = 0
+        self.scanned = 0
+        self.popped = 0
+        self.sequence = itertools.count()
+        self.set_cursor(0)
+
+    # The cursor is the index of the bucket of time (counted from time 0), no event is scheduled before it
+    def set_cursor(self, time):
+        self.cursor = int(time // self.width)
+
+    def enqueue(self, event, priority=0):
+        self.push((event.time, priority, next(self.sequence), event))
+
+    def push(self, key):
+        index = int(key[0] // self.width)
+        heapq.heappush(self.buckets[index % len(self.buckets)], key)
+        self.size += 1
+        if index < self.cursor:
+            self.cursor = index
+        if self.size > 2 * len(self.buckets):
+            self.resize(2 * len(self.buckets))
+
+    def pop(self):
+        key = self.peek_key()
+        heapq.heappop(self.buckets[self.cursor % len(self.buckets)])
+        self.size -= 1
+        self.popped += 1
+        if self.initial_buckets < len(self.buckets) and self.size < len(self.buckets) // 2:
+            self.resize(len(self.buckets) // 2)
+        elif self.popped >= len(self.buckets) and self.scanned > 4 * self.popped:
+            # most buckets are empty, so the width is too small for the current events
+            self.resize(len(self.buckets))
+        return key[-1]
+
+    def peek(self):
+        return self.peek_key()[-1]
+
+    # Moves the cursor to the bucket of the first event, and returns its key
+    def peek_key(self):
+        self.ensure_not_empty()
+        n_buckets = len(self.buckets)
+        for _ in range(n_buckets):
+            bucket = self.buckets[self.cursor % n_buckets]
+            if bucket and bucket[0][0] // self.width <= self.cursor:
+                return bucket[0]
+            self.cursor += 1
+            self.scanned += 1
+
+        # there is no event in the coming year, so the bucket width does not fit the events anymore
+        self.resize(n_buckets)
+        return self.peek_key()
+
+    # Redistributes the events over n_buckets buckets, with a width of a few times the mean separation of the events
+    def resize(self, n_buckets):
+        keys = [key for bucket in self.buckets for key in bucket]
+        first = min(keys)[0] if keys else 0
+        last = max(keys)[0] if keys else 0
+        if last > first:
+            self.width = 3 * (last - first) / len(keys)
+
+        self.buckets = [[] for _ in range(n_buckets)]
+        self.scanned = 0
+        self.popped = 0
+        for key in keys:
+            heapq.heappush(self.buckets[int(key[0] // self.width) % n_buckets], key)
+        self.set_cursor(first)
+
+    def is_empty(self):
+        return self.size == 0
+
+    def __len__(self):
+        return self.size
+
+    def ensure_not_empty(self):
+        if self.size == 0:
+            raise RuntimeError('The queue is empty')
+
 def to_time(minutes):
     minutes = round(minutes)
     return f'{((minutes // 60) % 24):02}:{(minutes % 60):02}'
\ No newline at end of file